@@ -2,21 +2,33 @@
 
 """This module implements common things to do with your switch"""
 
-from typing import List
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Iterator, Set
 import time
+import selectors
 import socket
+import threading
 
-from TLCrypt import tl_rc4_crypt
-from TLPacketForge import forge_cable_test, forge_discovery, \
-    forge_get_token, forge_login, forge_get_port_stats, forge_get_qos
+from TLCrypt import tl_rc4_crypt, tl_rc4_crypt_into
+from TLPacketForge import forge_cable_test, forge_discovery, forge_question, \
+    forge_get_token, forge_login, forge_get_port_stats, forge_get_qos, REQUEST_TEMPLATES
 from TLPacket import TLPacket
 from TLPresentation import is_discovery
+from TLReassembly import TLReassembly, TLReassemblyError
+from TLSequence import TLSequenceAllocator
 from TLTLVs import TLTLV, TLVTAGS
 
 
+class TLBuffers(threading.local):
+    """Reused for every datagram received or sent, en- and decrypted in place. Each thread has its own."""
+
+    def __init__(self):
+        self.receive = bytearray(1500)  # type: bytearray
+        self.send = bytearray(1500)  # type: bytearray
+
+
 class TLSwitch:
     """This is a switch"""
-    discovered_switches = []  # type: List[TLSwitch]
 
     def __init__(self, packet: TLPacket):
         self.name = ...  # type: str
@@ -25,13 +37,98 @@ class TLSwitch:
 
         self.source_packet = packet  # type: TLPacket
 
-        for i in packet.tlvs:
-            if i.tag == 2:
-                self.name = i.get_human_readable_value()
-            elif i.tag == 4:
-                self.ip4 = i.get_human_readable_value()
-            elif i.tag == 3:
-                self.mac = i.value
+        tlv = packet.get(TLVTAGS['SYSINFO_DESCRIPTION'])  # type: TLTLV
+        if tlv is not None:
+            self.name = tlv.get_human_readable_value()
+
+        tlv = packet.get(TLVTAGS['SYSINFO_IP'])
+        if tlv is not None:
+            self.ip4 = tlv.get_human_readable_value()
+
+        tlv = packet.get(TLVTAGS['SYSINFO_MAC'])
+        if tlv is not None:
+            self.mac = tlv.value
+
+
+class TLSwitchRegistry:
+    """The switches known to a client, indexed by MAC and IP address.
+    Switches not seen for ttl seconds are forgotten, without ttl they are kept forever."""
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl  # type: float
+        self._by_mac = {}  # type: Dict[bytes, TLSwitch]
+        self._by_ip = {}  # type: Dict[str, TLSwitch]
+        self._last_seen = {}  # type: Dict[bytes, float]
+
+    def __len__(self) -> int:
+        self.evict()
+        return len(self._by_mac)
+
+    def __iter__(self) -> Iterator[TLSwitch]:
+        self.evict()
+        return iter(list(self._by_mac.values()))
+
+    def __getitem__(self, index: int) -> TLSwitch:
+        return list(self)[index]
+
+    def __contains__(self, mac: bytes) -> bool:
+        return self.by_mac(mac) is not None
+
+    def add(self, switch: TLSwitch, now: float = None) -> bool:
+        """Adds or refreshes the switch. Returns whether it was unknown before."""
+        now = time.monotonic() if now is None else now  # type: float
+        self.evict(now)
+
+        known = self._by_mac.get(switch.mac)  # type: TLSwitch
+        if known is not None and self._by_ip.get(known.ip4) is known:
+            del self._by_ip[known.ip4]
+
+        # Another switch might have used the IP address before.
+        previous = self._by_ip.get(switch.ip4)  # type: TLSwitch
+        if previous is not None and previous.mac != switch.mac:
+            self.remove(previous.mac)
+
+        self._by_mac[switch.mac] = switch
+        self._by_ip[switch.ip4] = switch
+        self._last_seen[switch.mac] = now
+
+        return known is None
+
+    def remove(self, mac: bytes) -> None:
+        """Forgets the switch."""
+        switch = self._by_mac.pop(mac, None)  # type: TLSwitch
+        self._last_seen.pop(mac, None)
+        if switch is not None and self._by_ip.get(switch.ip4) is switch:
+            del self._by_ip[switch.ip4]
+
+    def clear(self) -> None:
+        """Forgets all switches."""
+        self._by_mac.clear()
+        self._by_ip.clear()
+        self._last_seen.clear()
+
+    def evict(self, now: float = None) -> None:
+        """Forgets all switches not seen within ttl."""
+        if self.ttl is None:
+            return
+
+        now = time.monotonic() if now is None else now
+        for mac in [mac for mac, seen in self._last_seen.items() if now - seen > self.ttl]:
+            self.remove(mac)
+
+    def by_mac(self, mac: bytes) -> TLSwitch:
+        """The switch with the MAC address, None if unknown."""
+        self.evict()
+        return self._by_mac.get(mac)
+
+    def by_ip(self, ip4: str) -> TLSwitch:
+        """The switch with the IP address, None if unknown."""
+        self.evict()
+        return self._by_ip.get(ip4)
+
+    def last_seen(self, mac: bytes) -> float:
+        """time.monotonic() of the last answer of the switch, None if unknown."""
+        return self._last_seen.get(mac)
 
 
 PORTCS = int.from_bytes(b'tp', 'big')  # type: int
@@ -41,6 +138,15 @@ PORTSC = PORTCS + 1  # type: int
 BROADCAST_IP = '255.255.255.255'  # type: str
 SENDER = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # type: socket
 RECEIVER = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # type: socket
+SELECTOR = selectors.DefaultSelector()  # type: selectors.BaseSelector
+SEQUENCES = TLSequenceAllocator()  # type: TLSequenceAllocator
+REGISTRY = TLSwitchRegistry()  # type: TLSwitchRegistry
+BUFFERS = TLBuffers()  # type: TLBuffers
+
+
+# Longest time a thread waiting for a reply sleeps in the selector before checking whether
+# the receive loop of another thread dispatched the reply to it.
+DISPATCH_INTERVAL = 0.05  # type: float
 
 DEBUG = False
 
@@ -50,105 +156,280 @@ def tl_init_sockets() -> None:
     SENDER.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
     RECEIVER.bind(('0.0.0.0', PORTSC))
     RECEIVER.setblocking(False)
+    SELECTOR.register(RECEIVER, selectors.EVENT_READ)
+
+
+def tl_send(outgoing_packet: TLPacket, target: str) -> None:
+    """Serializes the packet into the send buffer of the thread, encrypts it in place and sends it."""
+    buffer = BUFFERS.send  # type: bytearray
+    if outgoing_packet.size() > len(buffer):
+        data = memoryview(outgoing_packet.to_byte_array())  # type: memoryview
+    else:
+        data = memoryview(buffer)[:outgoing_packet.serialize_into(buffer)]
+
+    tl_rc4_crypt_into(data)
+    SENDER.sendto(data, (target, PORTCS))
+
+
+def tl_receive() -> TLPacket:
+    """Receives and decrypts a single datagram into the receive buffer of the thread and parses it."""
+    buffer = BUFFERS.receive  # type: bytearray
+    length = RECEIVER.recv_into(buffer)  # type: int
+    view = memoryview(buffer)[:length]  # type: memoryview
+    tl_rc4_crypt_into(view)
+    return TLPacket(view)
+
+
+def tl_receive_until(deadline: float, done: Callable[[], bool] = None) -> Iterator[TLPacket]:
+    """Yields every packet received until the time.monotonic() deadline passes.
+    Sleeps in the selector while there is nothing to read.
+    With done, returns as soon as done() is true. As the receive loop of another thread may have
+    dispatched the awaited reply, done is checked at least every DISPATCH_INTERVAL seconds."""
+    while done is None or not done():
+        remaining = deadline - time.monotonic()  # type: float
+        if remaining <= 0:
+            return
+
+        if not SELECTOR.select(remaining if done is None else min(remaining, DISPATCH_INTERVAL)):
+            continue
+
+        # Drain everything that is pending before waiting again.
+        while True:
+            try:
+                packet = tl_receive()  # type: TLPacket
+            except IOError:
+                break
+
+            yield packet
+            if done is not None and done():
+                return
+
+
+def tl_exchange(send: Callable[[int], None], switchmac: bytes, timeout: float=1) -> TLPacket:
+    """Allocates a sequence number, lets send transmit the request with it and returns the answer, if any."""
+    answers = []  # type: List[TLPacket]
+
+    def waiter(packet: TLPacket) -> bool:
+        if packet.mac_switch != switchmac:
+            return False
+        answers.append(packet)
+        return True
+
+    sequence_number = SEQUENCES.allocate(waiter)  # type: int
+
+    try:
+        send(sequence_number)
+
+        for incoming_packet in tl_receive_until(time.monotonic() + timeout, lambda: bool(answers)):  # type: TLPacket
+            SEQUENCES.dispatch(incoming_packet)
+    finally:
+        SEQUENCES.release(sequence_number)
+
+    if not answers:
+        return None
+
+    if DEBUG:
+        print(answers[0])
+    return answers[0]
+
+
+def tl_collect_fragments(send: Callable[[int], None], switchmac: bytes, reassembly: TLReassembly,
+                         timeout: float=1) -> Iterator[None]:
+    """Like tl_exchange, but feeds every datagram of the answer into reassembly. Yields whenever fragments
+    were added, until the reply is complete or no fragment arrived for timeout seconds."""
+    # Appended to by whichever thread dispatches the fragment.
+    fragments = deque()  # type: Deque[TLPacket]
+
+    def waiter(packet: TLPacket) -> bool:
+        if packet.mac_switch != switchmac:
+            return False
+        fragments.append(packet)
+        return True
+
+    sequence_number = SEQUENCES.allocate(waiter)  # type: int
+
+    try:
+        send(sequence_number)
+
+        while not reassembly.complete:
+            added = False  # type: bool
+            deadline = time.monotonic() + timeout  # type: float
+
+            # Duplicates do not count, wait on for new fragments then.
+            while not added and time.monotonic() < deadline:
+                for incoming_packet in tl_receive_until(deadline, lambda: bool(fragments)):  # type: TLPacket
+                    SEQUENCES.dispatch(incoming_packet)
+
+                while fragments:
+                    fragment = fragments.popleft()  # type: TLPacket
+                    if DEBUG:
+                        print(fragment)
+                    added = reassembly.add(fragment) or added
+
+            if not added:
+                return
+
+            yield
+    finally:
+        SEQUENCES.release(sequence_number)
 
 
 def tl_send_and_wait_for_response(
         outgoing_packet: TLPacket, target: str=BROADCAST_IP, timeout: float=1) -> TLPacket:
     """Sends packet and returns the answer, if any."""
-    SENDER.sendto(tl_rc4_crypt(bytes(outgoing_packet.to_byte_array())), (target, PORTCS))
-    if DEBUG:
-        print(outgoing_packet)
+    def send(sequence_number: int) -> None:
+        outgoing_packet.sequence_number = sequence_number
+        tl_send(outgoing_packet, target)
+        if DEBUG:
+            print(outgoing_packet)
 
-    start = time.time()  # type: float
+    return tl_exchange(send, outgoing_packet.mac_switch, timeout)
 
-    while time.time() - start <= timeout:
-        try:
-            data = RECEIVER.recvfrom(1500)[0]  # type: bytes
-            incoming_packet = TLPacket(tl_rc4_crypt(data))  # type: TLPacket
-
-            if incoming_packet.sequence_number == outgoing_packet.sequence_number:
-                if DEBUG:
-                    print(incoming_packet)
-                return incoming_packet
 
-        except IOError:
-            pass
+def tl_request(switchip: str, timeout: float, forge: Callable[..., bytes], *args: Any) -> TLPacket:
+    """Sends the request forge(*args) from its cached, encrypted template and returns the answer, if any.
+    The first argument of every forge function but forge_discovery is the MAC of the switch."""
+    def send(sequence_number: int) -> None:
+        datagram = REQUEST_TEMPLATES.datagram(sequence_number, forge, *args)  # type: bytearray
+        SENDER.sendto(datagram, (switchip, PORTCS))
+        if DEBUG:
+            print(TLPacket(tl_rc4_crypt(datagram)))
 
-    return None
+    return tl_exchange(send, args[0], timeout)
 
 
-def tl_discover(target: str=BROADCAST_IP, duration: float=1) -> TLSwitch:
-    """Do a survey or ask a specified switch for its identity"""
+def tl_discover_all(target: str=BROADCAST_IP, duration: float=1, expected: int=None, macs: Set[bytes]=None,
+                    callback: Callable[[TLSwitch], None]=None, retry: float=0.1) -> List[TLSwitch]:
+    """Do a survey or ask a specified switch for its identity, returning every unit that answered.
+    Returns as soon as expected units or all units in macs answered, else after duration.
+    The request is repeated after retry seconds, with the interval doubling each time, in case it got lost.
+    callback is called with each unit as soon as it answers."""
     discovery_request = TLPacket(forge_discovery())  # type: TLPacket
-    SENDER.sendto(tl_rc4_crypt(bytes(discovery_request.to_byte_array())), (target, PORTCS))
+    answers = []  # type: List[TLPacket]
+    found = {}  # type: Dict[bytes, TLSwitch]
+
+    def waiter(packet: TLPacket) -> bool:
+        if not is_discovery(discovery_request, packet):
+            return False
+        answers.append(packet)
+        return True
+
+    def complete() -> bool:
+        return ((expected is not None and len(found) >= expected) or
+                (macs is not None and macs.issubset(found.keys())))
+
+    discovery_request.sequence_number = SEQUENCES.allocate(waiter)
+    end = time.monotonic() + duration  # type: float
+    next_send = time.monotonic()  # type: float
+
+    try:
+        while time.monotonic() < end:
+            if time.monotonic() >= next_send:
+                tl_send(discovery_request, target)
+                next_send = time.monotonic() + retry
+                retry *= 2
 
-    if DEBUG:
-        print(discovery_request)
+                if DEBUG:
+                    print(discovery_request)
 
-    start = time.time()  # type: float
+            for packet in tl_receive_until(min(next_send, end)):  # type: TLPacket
+                SEQUENCES.dispatch(packet)
 
-    while time.time() - start <= duration:
-        try:
-            data = RECEIVER.recvfrom(1500)[0]  # type: bytes
-            packet = TLPacket(tl_rc4_crypt(data))  # type: TLPacket
+                while answers:
+                    this_one = TLSwitch(answers.pop())  # type: TLSwitch
 
-            if is_discovery(discovery_request, packet):
-                found = False  # type: bool
-                this_one = TLSwitch(packet)  # type: TLSwitch
+                    if DEBUG:
+                        print(this_one.source_packet)
 
-                if DEBUG:
-                    print(packet)
+                    REGISTRY.add(this_one)
+                    if this_one.mac not in found:
+                        found[this_one.mac] = this_one
+                        if callback is not None:
+                            callback(this_one)
 
-                for i in TLSwitch.discovered_switches:
-                    if i.ip4 == this_one.ip4:
-                        found = True
+                if complete():
+                    return list(found.values())
+    finally:
+        SEQUENCES.release(discovery_request.sequence_number)
+
+    return list(found.values())
+
+
+def tl_discover(target: str=BROADCAST_IP, duration: float=1) -> TLSwitch:
+    """Do a survey or ask a specified switch for its identity"""
+    if target != BROADCAST_IP:
+        found = tl_discover_all(target, duration, expected=1)  # type: List[TLSwitch]
+        return found[0] if found else None
 
-                if not found:
-                    TLSwitch.discovered_switches.append(this_one)
-                    if target != BROADCAST_IP:
-                        return this_one
-        except IOError:
-            pass
+    tl_discover_all(target, duration)
 
-    if len(TLSwitch.discovered_switches) == 1:
-        return TLSwitch.discovered_switches[0]
+    if len(REGISTRY) == 1:
+        return REGISTRY[0]
     else:
         return None
 
 
 def tl_get_token(switchmac: bytes, switchip: str, timeout: float=1) -> int:
     """Retrieves a token used as a reference for a session. AKA session id."""
-    forged = TLPacket(forge_get_token(switchmac))  # type: TLPacket
-    result = tl_send_and_wait_for_response(forged, switchip, timeout)  # type: TLPacket
+    result = tl_request(switchip, timeout, forge_get_token, switchmac)  # type: TLPacket
     return None if result is None else result.token
 
 
 def tl_login(switchmac: bytes, switchip: str, token: int,
              user: str, password: str, timeout: float=1) -> int:
     """Performs a login: Necessary for nearly every further action"""
-    forged = TLPacket(forge_login(switchmac, token, user, password))  # type: TLPacket
-    result = tl_send_and_wait_for_response(forged, switchip, timeout)  # type: TLPacket
+    result = tl_request(switchip, timeout, forge_login, switchmac, token, user, password)  # type: TLPacket
 
     return None if result is None else result.error_code
 
 
 def tl_get_port_statistics(switchmac: bytes, switchip: str, token: int, timeout: float=1) -> TLPacket:
     """Get the statistics for all PHYs"""
-    forged = TLPacket(forge_get_port_stats(switchmac, token))  # type: TLPacket
-    return tl_send_and_wait_for_response(forged, switchip, timeout)
+    return tl_request(switchip, timeout, forge_get_port_stats, switchmac, token)
 
 
 def tl_test_cable(switchmac: bytes, switchip: str, token: int, portnum: int,
                   user: str, password: str, timeout: float=10) -> TLPacket:
     """Tests the cable attached to the switch"""
-    forged = TLPacket(forge_cable_test(switchmac, token, portnum, user, password))  # type: TLPacket
-    return tl_send_and_wait_for_response(forged, switchip, timeout)
+    return tl_request(switchip, timeout, forge_cable_test, switchmac, token, portnum, user, password)
 
 
 def tl_get_qos(switchmac: bytes, switchip: str, token: int, timeout: float=1) -> TLPacket:
     """Retrieves the QoS settings."""
-    forged = TLPacket(forge_get_qos(switchmac, token))
-    return tl_send_and_wait_for_response(forged, switchip, timeout)
+    return tl_request(switchip, timeout, forge_get_qos, switchmac, token)
+
+
+def tl_get_table(switchmac: bytes, switchip: str, token: int, tag: int, timeout: float=1) -> TLPacket:
+    """Retrieves a table that may be spread over several datagrams, combined into a single packet.
+    The packet is marked truncated if fragments are missing."""
+    reassembly = TLReassembly()  # type: TLReassembly
+
+    def send(sequence_number: int) -> None:
+        SENDER.sendto(REQUEST_TEMPLATES.datagram(sequence_number, forge_question, switchmac, token, tag),
+                      (switchip, PORTCS))
+
+    for _ in tl_collect_fragments(send, switchmac, reassembly, timeout):
+        pass
+
+    return None if reassembly.received == 0 else reassembly.packet()
+
+
+def tl_stream_table(switchmac: bytes, switchip: str, token: int, tag: int, timeout: float=1) -> Iterator[TLTLV]:
+    """Like tl_get_table, but yields the TLVs in order as their datagrams arrive, without keeping them.
+    Raises TLReassemblyError once the datagrams stop arriving before the reply is complete."""
+    reassembly = TLReassembly()  # type: TLReassembly
+
+    def send(sequence_number: int) -> None:
+        SENDER.sendto(REQUEST_TEMPLATES.datagram(sequence_number, forge_question, switchmac, token, tag),
+                      (switchip, PORTCS))
+
+    for _ in tl_collect_fragments(send, switchmac, reassembly, timeout):
+        for tlv in reassembly.ready_tlvs():  # type: TLTLV
+            if tlv.tag != TLVTAGS['EOT']:
+                yield tlv
+
+    if not reassembly.complete:
+        raise TLReassemblyError('Reply incomplete, {0:d} datagram(s) received.'.format(reassembly.received))
 
 
 def tl_test(test: int, switchmac: bytes, switchip: str, token: int, timeout: float=1) -> TLPacket:
@@ -157,7 +438,6 @@ def tl_test(test: int, switchmac: bytes, switchip: str, token: int, timeout: flo
     forged.opcode = 1
     forged.token = token
     forged.mac_switch = switchmac
-    forged.sequence_number = 2342
 
     nt = TLTLV(test, None)
     forged.tlvs.append(nt)
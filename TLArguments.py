@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+"""Argument types shared by the subcommands. They raise ArgumentTypeError, which argparse reports as usage error."""
+
+import argparse
+import ipaddress
+
+
+def positive_float(text: str) -> float:
+    """A number greater than 0."""
+    value = float(text)  # type: float
+    if not value > 0:
+        raise argparse.ArgumentTypeError('must be greater than 0, not {0}'.format(text))
+    return value
+
+
+def ipv4_interface(text: str) -> str:
+    """An IPv4 network in CIDR notation, optionally with a host address, like 192.168.1.10/24."""
+    try:
+        return str(ipaddress.IPv4Interface(text))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def tlv_tag(text: str) -> int:
+    """A TLV tag, decimal or with prefix like 0x4000."""
+    try:
+        value = int(text, 0)  # type: int
+    except ValueError:
+        raise argparse.ArgumentTypeError('not a number: {0}'.format(text))
+    if not 0 <= value <= 0xFFFF:
+        raise argparse.ArgumentTypeError('tags range from 0 to 65535, not {0}'.format(text))
+    return value
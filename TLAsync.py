@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+
+"""asyncio implementation of the actions in TLActions. Allows many requests in flight at once."""
+
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Tuple
+import asyncio
+import ipaddress
+import socket
+
+from TLCrypt import tl_rc4_crypt, tl_rc4_crypt_into
+from TLPacketForge import forge_cable_test, forge_discovery, forge_question, \
+    forge_get_token, forge_login, forge_get_port_stats, forge_get_qos, REQUEST_TEMPLATES
+from TLPacket import TLPacket, TLERRORCODES
+from TLPresentation import is_discovery
+from TLReassembly import TLReassembly, TLReassemblyError
+from TLSequence import TLSequenceAllocator
+import TLActions
+from TLInfos import CableTestResult, cable_test_results
+from TLTLVs import TLVTAGS
+from TLActions import TLSwitch, TLSwitchRegistry, BROADCAST_IP, PORTCS, PORTSC
+
+
+class TLDatagramProtocol(asyncio.DatagramProtocol):
+    """Decrypts incoming datagrams and hands them to the client."""
+
+    def __init__(self, client: 'TLAsyncClient'):
+        self.client = client  # type: TLAsyncClient
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        self.client.packet_received(TLPacket(tl_rc4_crypt(data)))
+
+    def error_received(self, exc: Exception) -> None:
+        if TLActions.DEBUG:
+            print('Socket error: {0}'.format(exc))
+
+
+class TLAsyncClient:
+    """A client using a single socket for all switches. Every pending request waits for a future
+    keyed on switch MAC and sequence number, so replies are matched no matter in which order they arrive.
+    Sequence numbers come from the clients own TLSequenceAllocator and never collide while in flight.
+    Switches found by discovery are kept in the registry, for ttl seconds or forever if None."""
+
+    def __init__(self, local_ip: str = '0.0.0.0', sock: socket.socket = None, ttl: float = None):
+        self.local_ip = local_ip  # type: str
+        self.sock = sock  # type: socket.socket
+        self.transport = None  # type: asyncio.DatagramTransport
+
+        self.sequences = TLSequenceAllocator()  # type: TLSequenceAllocator
+        self.registry = TLSwitchRegistry(ttl)  # type: TLSwitchRegistry
+        self._pending = {}  # type: Dict[int, asyncio.Future]
+
+    async def start(self) -> 'TLAsyncClient':
+        """Binds the socket. The switches answer to PORTSC, even when asked from another port.
+        If the client was given a socket already bound to PORTSC, that one is used instead."""
+        loop = asyncio.get_running_loop()
+
+        if self.sock is not None:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.sock.setblocking(False)
+            self.transport = (await loop.create_datagram_endpoint(
+                lambda: TLDatagramProtocol(self), sock=self.sock))[0]
+        else:
+            self.transport = (await loop.create_datagram_endpoint(
+                lambda: TLDatagramProtocol(self), local_addr=(self.local_ip, PORTSC), allow_broadcast=True))[0]
+        return self
+
+    def close(self) -> None:
+        """Closes the socket and cancels everything still waiting for an answer."""
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    async def __aenter__(self) -> 'TLAsyncClient':
+        return await self.start()
+
+    async def __aexit__(self, *_) -> None:
+        self.close()
+
+    def packet_received(self, packet: TLPacket) -> None:
+        """Resolves the future waiting for this packet, if any."""
+        if TLActions.DEBUG:
+            print(packet)
+
+        self.sequences.dispatch(packet)
+
+    def send(self, packet: TLPacket, target: str, transport: asyncio.DatagramTransport = None) -> None:
+        """Encrypts and sends the packet, through the clients socket unless another transport is given."""
+        data = packet.to_byte_array()  # type: bytearray
+        tl_rc4_crypt_into(data)
+        (self.transport if transport is None else transport).sendto(data, (target, PORTCS))
+
+        if TLActions.DEBUG:
+            print(packet)
+
+    async def exchange(self, send: Callable[[int], None], switchmac: bytes, timeout: float = 1) -> TLPacket:
+        """Allocates a sequence number, lets send transmit the request with it and returns the answer, if any."""
+        future = asyncio.get_running_loop().create_future()  # type: asyncio.Future
+
+        def waiter(incoming: TLPacket) -> bool:
+            if incoming.mac_switch != switchmac or future.done():
+                return False
+            future.set_result(incoming)
+            return True
+
+        sequence_number = self.sequences.allocate(waiter)  # type: int
+        self._pending[sequence_number] = future
+
+        try:
+            send(sequence_number)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._pending.pop(sequence_number, None)
+            self.sequences.release(sequence_number)
+
+    async def send_and_wait_for_response(self, packet: TLPacket, target: str = BROADCAST_IP,
+                                         timeout: float = 1) -> TLPacket:
+        """Sends packet and returns the answer, if any."""
+        def send(sequence_number: int) -> None:
+            packet.sequence_number = sequence_number
+            self.send(packet, target)
+
+        return await self.exchange(send, packet.mac_switch, timeout)
+
+    async def request(self, switchip: str, timeout: float, forge: Callable[..., bytes], *args: Any) -> TLPacket:
+        """Sends the request forge(*args) from its cached, encrypted template and returns the answer, if any.
+        The first argument of every forge function but forge_discovery is the MAC of the switch."""
+        def send(sequence_number: int) -> None:
+            datagram = REQUEST_TEMPLATES.datagram(sequence_number, forge, *args)  # type: bytearray
+            self.transport.sendto(datagram, (switchip, PORTCS))
+            if TLActions.DEBUG:
+                print(TLPacket(tl_rc4_crypt(datagram)))
+
+        return await self.exchange(send, args[0], timeout)
+
+    async def discover(self, target: str = BROADCAST_IP, duration: float = 1) -> List[TLSwitch]:
+        """Do a survey or ask a specified switch for its identity. Returns every unit found,
+        which is also added to the registry of the client."""
+        # A single unit was asked, there is no need to wait any longer than for its answer.
+        return await self._discover([(self.transport, target)], duration, target != BROADCAST_IP)
+
+    async def discover_networks(self, networks: Iterable[str], duration: float = 1,
+                                broadcast: bool = True, targets: Iterable[str] = ()) -> List[TLSwitch]:
+        """Discovers the units of several networks at once and merges the results.
+        Each network is given in CIDR notation and gets a directed broadcast. If it contains a host address,
+        like 192.168.1.10/24, the broadcast is sent from a socket bound to that address, i.e. from that interface.
+        With broadcast, the limited broadcast of discover is sent as well. targets are asked by unicast."""
+        loop = asyncio.get_running_loop()
+        sends = ([(self.transport, BROADCAST_IP)]
+                 if broadcast else [])  # type: List[Tuple[asyncio.DatagramTransport, str]]
+        sends.extend((self.transport, target) for target in targets)
+        transports = []  # type: List[asyncio.DatagramTransport]
+
+        try:
+            for text in networks:
+                interface = ipaddress.ip_interface(text)  # type: ipaddress.IPv4Interface
+                target = str(interface.network.broadcast_address)  # type: str
+
+                if interface.ip in (interface.network.network_address, interface.network.broadcast_address):
+                    sends.append((self.transport, target))
+                    continue
+
+                transport = (await loop.create_datagram_endpoint(
+                    asyncio.DatagramProtocol, local_addr=(str(interface.ip), 0), allow_broadcast=True))[0]
+                transports.append(transport)
+                sends.append((transport, target))
+
+            return await self._discover(sends, duration, False)
+        finally:
+            for transport in transports:
+                transport.close()
+
+    async def _discover(self, sends: List[Tuple[asyncio.DatagramTransport, str]], duration: float,
+                        first_only: bool) -> List[TLSwitch]:
+        """Sends one discovery request to every target through its transport and collects all answers.
+        Answers arrive at the clients socket, no matter which socket asked."""
+        request = TLPacket(forge_discovery())  # type: TLPacket
+        answers = []  # type: List[TLPacket]
+        first = asyncio.get_running_loop().create_future()  # type: asyncio.Future
+
+        def waiter(incoming: TLPacket) -> bool:
+            if not is_discovery(request, incoming):
+                return False
+            answers.append(incoming)
+            if not first.done():
+                first.set_result(incoming)
+            return True
+
+        request.sequence_number = self.sequences.allocate(waiter)
+
+        try:
+            for transport, target in sends:
+                self.send(request, target, transport)
+
+            if first_only:
+                try:
+                    await asyncio.wait_for(first, duration)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            self.sequences.release(request.sequence_number)
+
+        switches = {}  # type: Dict[bytes, TLSwitch]
+        for packet in answers:
+            switch = TLSwitch(packet)  # type: TLSwitch
+            switches.setdefault(switch.mac, switch)
+            self.registry.add(switch)
+
+        return list(switches.values())
+
+    async def get_token(self, switchmac: bytes, switchip: str, timeout: float = 1) -> int:
+        """Retrieves a token used as a reference for a session. AKA session id."""
+        result = await self.request(switchip, timeout, forge_get_token, switchmac)  # type: TLPacket
+        return None if result is None else result.token
+
+    async def login(self, switchmac: bytes, switchip: str, token: int,
+                    user: str, password: str, timeout: float = 1) -> int:
+        """Performs a login: Necessary for nearly every further action"""
+        result = await self.request(switchip, timeout, forge_login, switchmac, token, user, password)  # type: TLPacket
+        return None if result is None else result.error_code
+
+    async def get_port_statistics(self, switchmac: bytes, switchip: str, token: int,
+                                  timeout: float = 1) -> TLPacket:
+        """Get the statistics for all PHYs"""
+        return await self.request(switchip, timeout, forge_get_port_stats, switchmac, token)
+
+    async def test_cable(self, switchmac: bytes, switchip: str, token: int, portnum: int,
+                         user: str, password: str, timeout: float = 10) -> TLPacket:
+        """Tests the cable attached to the switch"""
+        return await self.request(switchip, timeout, forge_cable_test, switchmac, token, portnum, user, password)
+
+    async def get_qos(self, switchmac: bytes, switchip: str, token: int, timeout: float = 1) -> TLPacket:
+        """Retrieves the QoS settings."""
+        return await self.request(switchip, timeout, forge_get_qos, switchmac, token)
+
+    async def get_table(self, switchmac: bytes, switchip: str, token: int, tag: int,
+                        timeout: float = 1) -> TLPacket:
+        """Retrieves a table that may be spread over several datagrams, combined into a single packet.
+        Gives up when no fragment arrived for timeout seconds, marking the packet truncated."""
+        reassembly = TLReassembly()  # type: TLReassembly
+        arrived = asyncio.Event()  # type: asyncio.Event
+        errors = []  # type: List[TLReassemblyError]
+
+        def waiter(incoming: TLPacket) -> bool:
+            if incoming.mac_switch != switchmac:
+                return False
+            try:
+                if reassembly.add(incoming):
+                    arrived.set()
+            except TLReassemblyError as error:
+                errors.append(error)
+                arrived.set()
+            return True
+
+        sequence_number = self.sequences.allocate(waiter)  # type: int
+
+        try:
+            self.transport.sendto(REQUEST_TEMPLATES.datagram(sequence_number, forge_question, switchmac, token, tag),
+                                  (switchip, PORTCS))
+
+            while not reassembly.complete and not errors:
+                arrived.clear()
+                try:
+                    await asyncio.wait_for(arrived.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+        finally:
+            self.sequences.release(sequence_number)
+
+        if errors:
+            raise errors[0]
+
+        return None if reassembly.received == 0 else reassembly.packet()
+
+
+async def tl_poll_port_statistics(client: TLAsyncClient, switches: Iterable[TLSwitch], concurrency: int = 64,
+                                  deadline: float = 3, timeout: float = 1) -> AsyncIterator[Tuple[TLSwitch, TLPacket]]:
+    """Fetches token and port statistics of all switches, at most concurrency of them at once.
+    Yields every switch with its statistics as soon as they arrive, or with None if it did not answer
+    within deadline seconds."""
+    semaphore = asyncio.Semaphore(concurrency)  # type: asyncio.Semaphore
+
+    async def poll(switch: TLSwitch) -> Tuple[TLSwitch, TLPacket]:
+        async def token_and_statistics() -> TLPacket:
+            token = await client.get_token(switch.mac, switch.ip4, timeout)  # type: int
+            if token is None:
+                return None
+            return await client.get_port_statistics(switch.mac, switch.ip4, token, timeout)
+
+        async with semaphore:
+            try:
+                return switch, await asyncio.wait_for(token_and_statistics(), deadline)
+            except asyncio.TimeoutError:
+                return switch, None
+
+    for result in asyncio.as_completed([poll(switch) for switch in switches]):
+        yield await result
+
+
+def port_count(switch: TLSwitch) -> int:
+    """Number of ports the switch reported on discovery, 0 if unknown."""
+    tlv = switch.source_packet.get(TLVTAGS['SYSINFO_PORT_SUPPORT'])
+    return tlv.value[0] if tlv is not None and len(tlv.value) == 1 else 0
+
+
+async def tl_test_all_cables(client: TLAsyncClient, switches: Iterable[TLSwitch], user: str, password: str,
+                             per_switch: int = 4, timeout: float = 10,
+                             ports: Iterable[int] = None) -> AsyncIterator[Tuple[TLSwitch, int, CableTestResult, str]]:
+    """Tests the cables of all ports of all switches, at most per_switch ports of each switch at once.
+    Yields switch, port, result and error as soon as each test finished. If the test failed, the result is None
+    and error tells why. Failures of a whole switch come first, one for each port it should have tested.
+    The ports default to the number of ports the switch reported on discovery, port is None if that is unknown.
+    Fetching the token and logging in may take up to timeout seconds each, like every single test."""
+    failures = []  # type: List[Tuple[TLSwitch, int, CableTestResult, str]]
+
+    async def test_switch(switch: TLSwitch) -> List['asyncio.Future']:
+        numbers = list(range(1, port_count(switch) + 1)) if ports is None else list(ports)  # type: List[int]
+        if not numbers:
+            if ports is None:
+                failures.append((switch, None, None, 'number of ports unknown'))
+            return []
+
+        error = None  # type: str
+        token = await client.get_token(switch.mac, switch.ip4, timeout)  # type: int
+        if token is None:
+            error = 'no token, switch does not answer'
+        else:
+            # Log in once, instead of relying on the credentials every single test carries.
+            error_code = await client.login(switch.mac, switch.ip4, token, user, password, timeout)  # type: int
+            if error_code is None:
+                error = 'no answer to login'
+            elif error_code != 0:
+                error = 'login failed: {0}'.format(TLERRORCODES.get(error_code, error_code))
+
+        if error is not None:
+            failures.extend((switch, portnum, None, error) for portnum in numbers)
+            return []
+
+        semaphore = asyncio.Semaphore(per_switch)  # type: asyncio.Semaphore
+
+        async def test_port(portnum: int) -> Tuple[TLSwitch, int, CableTestResult, str]:
+            async with semaphore:
+                packet = await client.test_cable(switch.mac, switch.ip4, token, portnum,
+                                                 user, password, timeout)  # type: TLPacket
+            if packet is None:
+                return switch, portnum, None, 'no answer'
+            if packet.error_code != 0:
+                return switch, portnum, None, TLERRORCODES.get(packet.error_code, str(packet.error_code))
+
+            results = [i for i in cable_test_results(packet) if i.port == portnum]  # type: List[CableTestResult]
+            return switch, portnum, results[0] if results else None, None if results else 'no result for port'
+
+        return [asyncio.ensure_future(test_port(portnum)) for portnum in numbers]
+
+    tests = []  # type: List[asyncio.Future]
+    for started in await asyncio.gather(*[test_switch(switch) for switch in switches]):
+        tests.extend(started)
+
+    for failure in failures:
+        yield failure
+
+    for result in asyncio.as_completed(tests):
+        yield await result
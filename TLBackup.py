@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+"""Backup and restore of the switch configuration, streamed from and to files."""
+
+from collections import deque
+from typing import BinaryIO, Deque, Dict, List, Tuple
+import hashlib
+import json
+import os
+import time
+
+import TLActions
+from TLActions import SENDER, SEQUENCES, PORTCS, tl_collect_fragments, tl_receive_until, tl_send
+from TLPacket import TLPacket
+from TLPacketForge import forge_backup, forge_restore_fragment, REQUEST_TEMPLATES
+from TLReassembly import TLReassembly
+from TLSession import TLSession
+from TLTLVs import TLTLV, TLVTAGS
+
+# Bytes of the configuration file per datagram when restoring. Leaves room for header and credentials.
+RESTORE_CHUNK = 1024  # type: int
+
+# Seconds to wait for the acknowledgement of a fragment before sending the next one. Switches that only
+# answer the whole file still get the datagrams spaced out, so their receive buffer is not overrun.
+RESTORE_PACING = 0.02  # type: float
+
+
+def tl_backup(session: TLSession, stream: BinaryIO, timeout: float = None) -> str:
+    """Writes the configuration file of the switch to stream as its datagrams arrive.
+    Returns the SHA-256 of the file, None if the switch refused or did not send all of it."""
+    timeout = session.timeout if timeout is None else timeout  # type: float
+    digest = hashlib.sha256()
+    received = {'complete': False, 'file': False}  # type: Dict[str, bool]
+
+    def exchange(token: int) -> TLPacket:
+        reassembly = TLReassembly()  # type: TLReassembly
+
+        def send(sequence_number: int) -> None:
+            SENDER.sendto(REQUEST_TEMPLATES.datagram(sequence_number, forge_backup, session.mac, token),
+                          (session.ip4, PORTCS))
+
+        # A refusal is a single datagram without file content, so nothing was written before a retry.
+        for _ in tl_collect_fragments(send, session.mac, reassembly, timeout):
+            for tlv in reassembly.ready_tlvs():  # type: TLTLV
+                if tlv.tag == TLVTAGS['SYSCFG_BACKUP_FILE']:
+                    stream.write(tlv.value)
+                    digest.update(tlv.value)
+                    received['file'] = True
+
+        received['complete'] = reassembly.complete
+        return reassembly.first
+
+    result = session.with_token(exchange, login=True)  # type: TLPacket
+    if result is None or result.error_code != 0 or not received['file']:
+        return None
+
+    if not received['complete']:
+        session.invalidate()
+        return None
+
+    return digest.hexdigest()
+
+
+def tl_restore_fragments(session: TLSession, stream: BinaryIO, token: int, timeout: float) -> TLPacket:
+    """Uploads the configuration file read from stream with the token, one fragment at a time.
+    After each fragment, waits up to RESTORE_PACING seconds for its acknowledgement, and stops at the first
+    that carries an error. Returns the answer to the last fragment, or to the one the switch refused."""
+    # Appended to by whichever thread dispatches the answer.
+    answers = deque()  # type: Deque[TLPacket]
+
+    def waiter(packet: TLPacket) -> bool:
+        if packet.mac_switch != session.mac:
+            return False
+        answers.append(packet)
+        return True
+
+    sequence_number = SEQUENCES.allocate(waiter)  # type: int
+
+    try:
+        fragment = 0  # type: int
+        chunk = stream.read(RESTORE_CHUNK)  # type: bytes
+
+        while True:
+            following = stream.read(RESTORE_CHUNK)  # type: bytes
+
+            # Acknowledgements arriving late are only checked for errors.
+            while answers:
+                answer = answers.popleft()  # type: TLPacket
+                if answer.error_code != 0:
+                    return answer
+
+            packet = forge_restore_fragment(session.mac, token, session.user, session.password,
+                                            chunk, fragment, not following)  # type: TLPacket
+            packet.sequence_number = sequence_number
+            tl_send(packet, session.ip4)
+
+            if TLActions.DEBUG:
+                print(packet)
+
+            deadline = time.monotonic() + (RESTORE_PACING if following else timeout)  # type: float
+            for incoming_packet in tl_receive_until(deadline, lambda: bool(answers)):  # type: TLPacket
+                SEQUENCES.dispatch(incoming_packet)
+
+            if not following:
+                return answers.popleft() if answers else None
+
+            if answers and answers[0].error_code != 0:
+                return answers.popleft()
+
+            chunk = following
+            fragment += 1
+    finally:
+        SEQUENCES.release(sequence_number)
+
+
+def tl_restore(session: TLSession, stream: BinaryIO, timeout: float = None) -> int:
+    """Uploads the configuration file read from stream, see tl_restore_fragments.
+    If the token was rejected, the upload starts over with a new one, provided the stream can seek.
+    Returns the error code of the switch, None on timeout."""
+    timeout = session.timeout if timeout is None else timeout  # type: float
+    if session.user is None:
+        raise ValueError('Restoring the configuration needs user and password.')
+
+    start = stream.tell() if stream.seekable() else None  # type: int
+    answers = []  # type: List[TLPacket]
+
+    def exchange(token: int) -> TLPacket:
+        if answers:
+            if start is None:
+                # The file cannot be read again, the rejection stands.
+                return answers[-1]
+            stream.seek(start)
+
+        answers.append(tl_restore_fragments(session, stream, token, timeout))
+        return answers[-1]
+
+    result = session.with_token(exchange)  # type: TLPacket
+    return None if result is None else result.error_code
+
+
+class TLBackupStore:
+    """A directory of configuration backups, one file per switch named after its MAC address.
+    The SHA-256 of every file is kept in hashes.json, so unchanged configurations are not written again."""
+
+    def __init__(self, directory: str):
+        self.directory = directory  # type: str
+        self.hashes_path = os.path.join(directory, 'hashes.json')  # type: str
+
+        try:
+            with open(self.hashes_path, 'r') as hashes_file:
+                self.hashes = json.load(hashes_file)  # type: Dict[str, str]
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def path(self, switchmac: bytes) -> str:
+        """File the configuration of the switch is stored in."""
+        return os.path.join(self.directory, switchmac.hex('-') + '.cfg')
+
+    def backup(self, session: TLSession, timeout: float = None) -> Tuple[bool, str]:
+        """Streams the configuration into a temporary file and keeps it only if it changed.
+        Returns whether it changed and the hash, which is None if the backup failed."""
+        os.makedirs(self.directory, exist_ok=True)
+        target = self.path(session.mac)  # type: str
+        temporary = target + '.tmp'  # type: str
+
+        try:
+            with open(temporary, 'wb') as backup_file:
+                digest = tl_backup(session, backup_file, timeout)  # type: str
+
+            key = session.mac.hex(':')  # type: str
+            if digest is None or (self.hashes.get(key) == digest and os.path.exists(target)):
+                return False, digest
+
+            os.replace(temporary, target)
+            self.hashes[key] = digest
+            self.save()
+
+            return True, digest
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    def save(self) -> None:
+        """Writes the hashes."""
+        temporary = self.hashes_path + '.tmp'  # type: str
+        with open(temporary, 'w') as hashes_file:
+            json.dump(self.hashes, hashes_file, indent=1, sort_keys=True)
+        os.replace(temporary, self.hashes_path)
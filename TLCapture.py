@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+"""Decodes TP-Link management traffic from pcap and pcapng captures.
+
+The capture is memory-mapped and walked record by record. Only the UDP payloads on PORTCS and PORTSC are copied.
+Switch MAC and opcode filters compare the encrypted header, tag filters walk the TLV headers without building
+TLVs, so decryption and full decoding are paid only for the packets that are written."""
+
+from collections import Counter
+from struct import Struct
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+import ipaddress
+import mmap
+
+from TLActions import PORTCS, PORTSC
+from TLCrypt import tl_rc4_crypt
+from TLPacket import TLPacket, HEADER, TLV_HEADER, TLERRORCODES
+from TLTLVs import TLTLV, TLVNAMES
+
+# Captures come in either byte order, so there is a Struct for each.
+PCAP_HEADER = {order: Struct(order + 'IHHiIII') for order in '<>'}  # type: Dict[str, Struct]
+PCAP_RECORD = {order: Struct(order + 'IIII') for order in '<>'}  # type: Dict[str, Struct]
+PCAP_MAGICS = {0xa1b2c3d4: 1e-6, 0xa1b23c4d: 1e-9}  # type: Dict[int, float]
+
+PCAPNG_BLOCK = {order: Struct(order + 'II') for order in '<>'}  # type: Dict[str, Struct]
+PCAPNG_SHORT = {order: Struct(order + 'H') for order in '<>'}  # type: Dict[str, Struct]
+PCAPNG_WORD = {order: Struct(order + 'I') for order in '<>'}  # type: Dict[str, Struct]
+PCAPNG_OPTION = {order: Struct(order + 'HH') for order in '<>'}  # type: Dict[str, Struct]
+PCAPNG_PACKET = {order: Struct(order + 'IIIII') for order in '<>'}  # type: Dict[str, Struct]
+PCAPNG_SECTION = 0x0a0d0d0a  # type: int
+PCAPNG_BYTE_ORDER = 0x1a2b3c4d  # type: int
+PCAPNG_INTERFACE = 1  # type: int
+PCAPNG_SIMPLE_PACKET = 3  # type: int
+PCAPNG_ENHANCED_PACKET = 6  # type: int
+PCAPNG_IF_TSRESOL = 9  # type: int
+
+# Link types and the offset of the ethertype (None for none) and the network layer in their frames:
+# BSD loopback, Ethernet, raw IP (twice), Linux cooked capture, raw IPv4 and Linux cooked capture v2.
+LINKTYPES = {0: (None, 4), 1: (12, 14), 12: (None, 0), 101: (None, 0),
+             113: (14, 16), 228: (None, 0), 276: (0, 20)}  # type: Dict[int, Tuple[int, int]]
+
+ETHERTYPE = Struct('>H')  # type: Struct
+ETHERTYPE_IPV4 = 0x0800  # type: int
+ETHERTYPE_VLANS = (0x8100, 0x88a8)  # type: Tuple[int, ...]
+IPV4 = Struct('>BBHHHBBH4s4s')  # type: Struct
+UDP = Struct('>HHHH')  # type: Struct
+IPPROTO_UDP = 17  # type: int
+
+# Binary log written by TLListener: the magic, then per datagram a record header and the encrypted datagram.
+# The header holds the time, whether it was sent to a switch, source address and port and the length.
+LOG_MAGIC = b'TLLOG\x00\x01\n'  # type: bytes
+LOG_RECORD = Struct('>d?4sHH')  # type: Struct
+
+
+class TLCaptureError(Exception):
+    """The file is no capture or is damaged."""
+
+
+class TLCaptureDatagram:
+    """A UDP datagram from or to one of the ports the switches use, still encrypted."""
+
+    __slots__ = ('timestamp', 'source', 'destination', 'source_port', 'destination_port', 'payload')
+
+    def __init__(self, timestamp: float, source: bytes, destination: bytes, source_port: int,
+                 destination_port: int, payload: bytes):
+        self.timestamp = timestamp  # type: float
+        self.source = source  # type: bytes
+        self.destination = destination  # type: bytes
+        self.source_port = source_port  # type: int
+        self.destination_port = destination_port  # type: int
+        self.payload = payload  # type: bytes
+
+    @property
+    def to_switch(self) -> bool:
+        """Whether the datagram was sent by a computer to a switch."""
+        return self.destination_port == PORTCS or (self.destination_port != PORTSC and self.source_port == PORTSC)
+
+
+def _pcap_frames(data: mmap.mmap) -> Iterator[Tuple[int, float, int, int]]:
+    """Yields link type, timestamp, offset and length of every frame of a pcap file."""
+    magic = int.from_bytes(data[:4], 'little')  # type: int
+    order = '<' if magic in PCAP_MAGICS else '>'  # type: str
+    resolution = PCAP_MAGICS.get(magic, PCAP_MAGICS.get(int.from_bytes(data[:4], 'big')))  # type: float
+
+    header = PCAP_HEADER[order]  # type: Struct
+    record = PCAP_RECORD[order]  # type: Struct
+    linktype = header.unpack_from(data)[6] & 0xffff  # type: int
+
+    offset = header.size  # type: int
+    end = len(data)  # type: int
+    while end - offset >= record.size:
+        seconds, fraction, captured, _ = record.unpack_from(data, offset)
+        offset += record.size
+        if offset + captured > end:
+            raise TLCaptureError('Capture ends within a frame.')
+
+        yield linktype, seconds + fraction * resolution, offset, captured
+        offset += captured
+
+
+def _pcapng_resolution(data: mmap.mmap, order: str, offset: int, end: int) -> float:
+    """The timestamp resolution given by the options of an interface description block, microseconds if none."""
+    option = PCAPNG_OPTION[order]  # type: Struct
+    while end - offset >= option.size:
+        code, length = option.unpack_from(data, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_IF_TSRESOL and length >= 1:
+            value = data[offset + option.size]  # type: int
+            return 2.0 ** -(value & 0x7f) if value & 0x80 else 10.0 ** -value
+        offset += option.size + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def _pcapng_frames(data: mmap.mmap) -> Iterator[Tuple[int, float, int, int]]:
+    """Yields link type, timestamp, offset and length of every packet of a pcapng file."""
+    order = '<'  # type: str
+    interfaces = []  # type: List[Tuple[int, float]]
+    offset = 0  # type: int
+    end = len(data)  # type: int
+
+    while end - offset >= 12:
+        if int.from_bytes(data[offset:offset + 4], 'little') == PCAPNG_SECTION:
+            # Every section may have its own byte order and starts numbering the interfaces anew.
+            order = '<' if int.from_bytes(data[offset + 8:offset + 12], 'little') == PCAPNG_BYTE_ORDER else '>'
+            interfaces = []
+
+        kind, length = PCAPNG_BLOCK[order].unpack_from(data, offset)
+        if length < 12 or offset + length > end:
+            raise TLCaptureError('Damaged block at offset {0:d}.'.format(offset))
+        body = offset + 8  # type: int
+
+        if kind == PCAPNG_INTERFACE:
+            linktype = PCAPNG_SHORT[order].unpack_from(data, body)[0]  # type: int
+            interfaces.append((linktype, _pcapng_resolution(data, order, body + 8, offset + length - 4)))
+        elif kind == PCAPNG_ENHANCED_PACKET:
+            interface, high, low, captured, _ = PCAPNG_PACKET[order].unpack_from(data, body)
+            if interface >= len(interfaces) or captured > length - 32:
+                raise TLCaptureError('Damaged packet block at offset {0:d}.'.format(offset))
+            linktype, resolution = interfaces[interface]
+            yield linktype, ((high << 32) | low) * resolution, body + 20, captured
+        elif kind == PCAPNG_SIMPLE_PACKET and interfaces:
+            yield interfaces[0][0], 0.0, body + 4, min(PCAPNG_WORD[order].unpack_from(data, body)[0], length - 16)
+
+        offset += length
+
+
+def _udp_datagram(data: mmap.mmap, linktype: int, timestamp: float, offset: int,
+                  length: int) -> TLCaptureDatagram:
+    """The datagram in the frame, if it is IPv4 and UDP from or to PORTCS or PORTSC. None otherwise."""
+    if linktype not in LINKTYPES:
+        return None
+
+    ethertype_offset, network = LINKTYPES[linktype]
+    end = offset + length  # type: int
+
+    if ethertype_offset is not None:
+        if length < network:
+            return None
+        ethertype = ETHERTYPE.unpack_from(data, offset + ethertype_offset)[0]  # type: int
+        while ethertype in ETHERTYPE_VLANS and linktype == 1 and end - offset - network >= 4:
+            ethertype = ETHERTYPE.unpack_from(data, offset + network + 2)[0]
+            network += 4
+        if ethertype != ETHERTYPE_IPV4:
+            return None
+
+    ip = offset + network  # type: int
+    if end - ip < IPV4.size:
+        return None
+
+    version_length, _, _, _, fragment, _, protocol, _, source, destination = IPV4.unpack_from(data, ip)
+    # Later fragments of a datagram carry no UDP header.
+    if version_length >> 4 != 4 or protocol != IPPROTO_UDP or fragment & 0x1fff:
+        return None
+
+    udp = ip + (version_length & 0x0f) * 4  # type: int
+    if end - udp < UDP.size:
+        return None
+
+    source_port, destination_port, udp_length, _ = UDP.unpack_from(data, udp)
+    if source_port not in (PORTCS, PORTSC) and destination_port not in (PORTCS, PORTSC):
+        return None
+
+    start = udp + UDP.size  # type: int
+    return TLCaptureDatagram(timestamp, source, destination, source_port, destination_port,
+                             data[start:min(end, udp + udp_length)])
+
+
+def _log_datagrams(data: mmap.mmap) -> Iterator[TLCaptureDatagram]:
+    """Yields the datagrams of a binary log of TLListener. The destination address was not recorded."""
+    offset = len(LOG_MAGIC)  # type: int
+    end = len(data)  # type: int
+    while end - offset >= LOG_RECORD.size:
+        timestamp, to_switch, source, source_port, length = LOG_RECORD.unpack_from(data, offset)
+        offset += LOG_RECORD.size
+        if offset + length > end:
+            raise TLCaptureError('Log ends within a datagram.')
+
+        yield TLCaptureDatagram(timestamp, source, bytes(4), source_port, PORTCS if to_switch else PORTSC,
+                                data[offset:offset + length])
+        offset += length
+
+
+def tl_read_capture(path: str) -> Iterator[TLCaptureDatagram]:
+    """Yields the datagrams from or to the ports of the switches in a pcap or pcapng file, still encrypted.
+    Binary logs of TLListener are read as well."""
+    with open(path, 'rb') as capture_file:
+        try:
+            data = mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise TLCaptureError('{0} is empty.'.format(path))
+
+    try:
+        magic = int.from_bytes(data[:4], 'little')  # type: int
+        if data[:len(LOG_MAGIC)] == LOG_MAGIC:
+            yield from _log_datagrams(data)
+            return
+        elif magic == PCAPNG_SECTION:
+            frames = _pcapng_frames(data)
+        elif magic in PCAP_MAGICS or int.from_bytes(data[:4], 'big') in PCAP_MAGICS:
+            frames = _pcap_frames(data)
+        else:
+            raise TLCaptureError('{0} is no pcap, pcapng or log file.'.format(path))
+
+        for frame in frames:
+            datagram = _udp_datagram(data, *frame)  # type: TLCaptureDatagram
+            if datagram is not None:
+                yield datagram
+    finally:
+        data.close()
+
+
+def tlv_tags(decrypted: bytes) -> Iterator[int]:
+    """Walks the TLV headers of a decrypted packet without building the TLVs."""
+    offset = HEADER.size  # type: int
+    end = len(decrypted)  # type: int
+    while end - offset >= TLV_HEADER.size:
+        tag, length = TLV_HEADER.unpack_from(decrypted, offset)
+        yield tag
+        offset += TLV_HEADER.size + length
+
+
+class TLCaptureFilter:
+    """Selects packets by switch MAC, opcode and tag. Empty sets let everything pass.
+    As the keystream is fixed, MACs and opcodes are compared while still encrypted."""
+
+    def __init__(self, macs: Iterable[bytes] = (), opcodes: Iterable[int] = (), tags: Iterable[int] = ()):
+        self.macs = set(macs)  # type: Set[bytes]
+        self.opcodes = set(opcodes)  # type: Set[int]
+        self.tags = set(tags)  # type: Set[int]
+
+    @property
+    def by_header(self) -> bool:
+        return bool(self.macs or self.opcodes)
+
+    def encrypted_header(self) -> Tuple[Set[bytes], Set[int]]:
+        """The MACs and opcodes as they appear in encrypted packets."""
+        keystream = tl_rc4_crypt(bytes(HEADER.size))  # type: bytes
+        return ({bytes(a ^ b for a, b in zip(mac, keystream[2:8])) for mac in self.macs},
+                {opcode ^ keystream[1] for opcode in self.opcodes})
+
+    def tags_match(self, decrypted: bytes) -> bool:
+        return not self.tags or not self.tags.isdisjoint(tlv_tags(decrypted))
+
+
+def tl_decode_capture(path: str, selection: TLCaptureFilter = None) -> Iterator[Tuple[TLCaptureDatagram, TLPacket]]:
+    """Yields every datagram of the capture with its packet, if it passes the filter.
+    Datagrams shorter than a header are skipped. The TLVs of the packets are only parsed when accessed."""
+    selection = TLCaptureFilter() if selection is None else selection  # type: TLCaptureFilter
+    macs, opcodes = selection.encrypted_header()
+
+    for datagram in tl_read_capture(path):
+        payload = datagram.payload  # type: bytes
+        if len(payload) < HEADER.size:
+            # Not even a header, so nothing of it could be decoded.
+            continue
+
+        if (macs and payload[2:8] not in macs) or (opcodes and payload[1] not in opcodes):
+            continue
+
+        decrypted = tl_rc4_crypt(payload)  # type: bytes
+        if selection.tags_match(decrypted):
+            yield datagram, TLPacket(decrypted)
+
+
+def packet_record(datagram: TLCaptureDatagram, packet: TLPacket) -> Dict[str, Any]:
+    """The decoded datagram as it is written as a JSON line."""
+    tlvs = packet.tlvs  # type: List[TLTLV]
+    return {'time': round(datagram.timestamp, 9),
+            'source': '{0}:{1:d}'.format(ipaddress.IPv4Address(datagram.source), datagram.source_port),
+            'destination': '{0}:{1:d}'.format(ipaddress.IPv4Address(datagram.destination), datagram.destination_port),
+            'to_switch': datagram.to_switch,
+            'version': packet.version,
+            'opcode': packet.opcode,
+            'switch': packet.mac_switch.hex(':'),
+            'computer': packet.mac_computer.hex(':'),
+            'sequence': packet.sequence_number,
+            'error': packet.error_code,
+            'error_name': TLERRORCODES.get(packet.error_code),
+            'fragment': packet.fragment,
+            'flags': packet.flags,
+            'token': packet.token,
+            'truncated': packet.truncated,
+            'tlvs': [{'tag': tlv.tag, 'name': TLVNAMES.get(tlv.tag),
+                      'value': None if tlv.value is None else tlv.value.hex()} for tlv in tlvs]}
+
+
+class TLCaptureSummary:
+    """Counts the decoded packets by direction, switch, opcode, error and tag."""
+
+    def __init__(self):
+        self.packets = 0  # type: int
+        self.bytes = 0  # type: int
+        self.truncated = 0  # type: int
+        self.first = None  # type: float
+        self.last = None  # type: float
+
+        self.directions = Counter()  # type: Counter
+        self.switches = Counter()  # type: Counter
+        self.opcodes = Counter()  # type: Counter
+        self.errors = Counter()  # type: Counter
+        self.tags = Counter()  # type: Counter
+
+    def add(self, datagram: TLCaptureDatagram, packet: TLPacket) -> None:
+        self.packets += 1
+        self.bytes += len(datagram.payload)
+        if self.first is None:
+            self.first = datagram.timestamp
+        self.last = datagram.timestamp
+
+        self.directions['computer to switch' if datagram.to_switch else 'switch to computer'] += 1
+        self.switches[packet.mac_switch.hex(':')] += 1
+        self.opcodes[packet.opcode] += 1
+        if not datagram.to_switch:
+            self.errors[TLERRORCODES.get(packet.error_code, str(packet.error_code))] += 1
+        for tlv in packet.iter_tlvs():  # type: TLTLV
+            self.tags[tlv.tag] += 1
+        self.truncated += packet.truncated
+
+    def __str__(self) -> str:
+        result = '{0:d} packets, {1:d} bytes'.format(self.packets, self.bytes)
+        if self.first is not None:
+            result += ', {0:.3f}s'.format(self.last - self.first)
+        result += ', {0:d} truncated\n'.format(self.truncated)
+
+        for title, counter, name in (('Direction', self.directions, str),
+                                     ('Switch', self.switches, str),
+                                     ('Opcode', self.opcodes, str),
+                                     ('Error', self.errors, str),
+                                     ('Tag', self.tags, lambda tag: '{0:d} ({1})'.format(tag, TLVNAMES.get(tag, '?')))):
+            result += '\n{0}\n'.format(title)
+            for key, count in counter.most_common():
+                result += '  {0:10d}  {1}\n'.format(count, name(key))
+
+        return result
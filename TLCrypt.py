@@ -2,33 +2,142 @@
 
 """Module to encapsulate TP-Link packet encryption functions."""
 
-from typing import List
+from typing import List, Iterable, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The secret crypto key
+_KEY = ("Ei2HNryt8ysSdRRI54XNQHBEbOIRqNjQgYxsTmuW3srSVRVFyLh8mwvhBLPFQph3" +
+        "ecDMLnDtjDUdrUwt7oTsJuYl72hXESNiD6jFIQCtQN1unsmn3JXjeYwGJ55pqTkV" +
+        "yN2OOm3vekF6G1LM4t3kiiG4lGwbxG4CG1s5Sli7gcINFBOLXQnPpsQNWDmPbOm7" +
+        "4mE7eyR3L7tk8tUhI17FLKm11hrrd1ck74bMw3VYSK3X5RrDgXelewMU6o1tJ3iX")  # type: str
+
+# Bytes of keystream generated up front. Covers every datagram that fits into an ethernet frame.
+KEYSTREAM_PRELOAD = 2048  # type: int
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class TLKeystream:
+    """The RC4 keystream of TP-Links fixed key.
+
+    As the key never changes, neither does the keystream. It is generated once and
+    every datagram is then encrypted or decrypted by XORing it with the keystream."""
+
+    def __init__(self, key: str = _KEY, preload: int = KEYSTREAM_PRELOAD):
+        self._sbox = list(range(256))  # type: List[int]
+        self._i = 0  # type: int
+        self._j = 0  # type: int
+        self._stream = bytearray()  # type: bytearray
+        self._array = None  # type: numpy.ndarray
+
+        # KSA Phase
+        j = 0  # type: int
+        for i in range(256):  # type: int
+            j = (j + self._sbox[i] + ord(key[i])) % 256
+            self._sbox[i], self._sbox[j] = self._sbox[j], self._sbox[i]
+
+        self.extend(preload)
+
+    def __len__(self) -> int:
+        return len(self._stream)
+
+    def extend(self, length: int) -> None:
+        """Makes sure at least length bytes of keystream are available."""
+        if length <= len(self._stream):
+            return
+
+        sbox = self._sbox  # type: List[int]
+        i, j = self._i, self._j  # type: int, int
+        stream = self._stream  # type: bytearray
+
+        # PRGA Phase
+        for _ in range(length - len(stream)):
+            i = (i + 1) % 256
+            j = (j + sbox[i]) % 256
+            sbox[i], sbox[j] = sbox[j], sbox[i]
+            stream.append(sbox[(sbox[i] + sbox[j]) % 256])
+
+        self._i, self._j = i, j
+
+        if numpy is not None:
+            self._array = numpy.frombuffer(bytes(stream), dtype=numpy.uint8)
+
+    def crypt(self, packet: bytes) -> bytearray:
+        """Encrypt AND decrypt the packet."""
+        length = len(packet)  # type: int
+        if length == 0:
+            return bytearray()
+
+        self.extend(length)
+
+        if self._array is not None:
+            data = numpy.frombuffer(packet, dtype=numpy.uint8)
+            return bytearray(numpy.bitwise_xor(data, self._array[:length]).tobytes())
+
+        # A single XOR of two big integers is way faster than a loop over the bytes.
+        result = (int.from_bytes(packet, 'little') ^
+                  int.from_bytes(self._stream[:length], 'little'))  # type: int
+        return bytearray(result.to_bytes(length, 'little'))
+
+    def crypt_into(self, source: Buffer, destination: Buffer = None) -> int:
+        """Encrypt AND decrypt source into the writable destination buffer without allocating a new packet.
+        Without destination, source is processed in place. Returns the number of bytes processed."""
+        source = memoryview(source).cast('B')  # type: memoryview
+        destination = source if destination is None else memoryview(destination).cast('B')  # type: memoryview
+        length = len(source)  # type: int
+
+        if len(destination) < length:
+            raise ValueError('Destination buffer too small: {0:d} < {1:d}'.format(len(destination), length))
+        if length == 0:
+            return 0
+
+        self.extend(length)
+
+        if self._array is not None:
+            numpy.bitwise_xor(numpy.frombuffer(source, dtype=numpy.uint8), self._array[:length],
+                              out=numpy.frombuffer(destination[:length], dtype=numpy.uint8))
+        else:
+            result = (int.from_bytes(source, 'little') ^
+                      int.from_bytes(self._stream[:length], 'little'))  # type: int
+            destination[:length] = result.to_bytes(length, 'little')
+
+        return length
+
+    def crypt_at(self, buffer: Buffer, offset: int, data: bytes) -> None:
+        """Encrypts data as if it was found at offset of a datagram and writes it there into buffer.
+        Patches a few bytes of an already encrypted datagram without touching the rest."""
+        self.extend(offset + len(data))
+        for position, char in enumerate(data, offset):  # type: int, int
+            buffer[position] = char ^ self._stream[position]
+
+    def crypt_batch(self, datagrams: Iterable[Buffer]) -> None:
+        """Encrypt AND decrypt every writable datagram in place."""
+        for datagram in datagrams:
+            self.crypt_into(datagram)
+
+
+KEYSTREAM = TLKeystream()  # type: TLKeystream
 
 
 def tl_rc4_crypt(packet: bytes) -> bytes:
     """Encrypt AND decrypt the packet using TP-Links default encryption."""
+    return KEYSTREAM.crypt(packet)
+
+
+def tl_rc4_crypt_into(source: Buffer, destination: Buffer = None) -> int:
+    """Encrypt AND decrypt source into destination, or in place if there is none."""
+    return KEYSTREAM.crypt_into(source, destination)
+
+
+def tl_rc4_crypt_at(buffer: Buffer, offset: int, data: bytes) -> None:
+    """Encrypt data into the encrypted datagram buffer at offset."""
+    KEYSTREAM.crypt_at(buffer, offset, data)
+
 
-    # The secret crypto key
-    key = ("Ei2HNryt8ysSdRRI54XNQHBEbOIRqNjQgYxsTmuW3srSVRVFyLh8mwvhBLPFQph3" +
-           "ecDMLnDtjDUdrUwt7oTsJuYl72hXESNiD6jFIQCtQN1unsmn3JXjeYwGJ55pqTkV" +
-           "yN2OOm3vekF6G1LM4t3kiiG4lGwbxG4CG1s5Sli7gcINFBOLXQnPpsQNWDmPbOm7" +
-           "4mE7eyR3L7tk8tUhI17FLKm11hrrd1ck74bMw3VYSK3X5RrDgXelewMU6o1tJ3iX")
-
-    sbox = list(range(256))  # type: List[int]
-    j = 0  # type: int
-    out = bytearray()  # type: bytearray
-
-    # KSA Phase
-    for i in range(256):  # type: int
-        j = (j + sbox[i] + ord(key[i])) % 256
-        sbox[i], sbox[j] = sbox[j], sbox[i]
-
-    # PRGA Phase
-    i = j = 0  # type: int
-    for char in packet:  # type: int
-        i = (i + 1) % 256
-        j = (j + sbox[i]) % 256
-        sbox[i], sbox[j] = sbox[j], sbox[i]
-        out.append((char ^ sbox[(sbox[i] + sbox[j]) % 256]))
-
-    return out
+def tl_rc4_crypt_batch(datagrams: Iterable[Buffer]) -> None:
+    """Encrypt AND decrypt a list of datagrams in place."""
+    KEYSTREAM.crypt_batch(datagrams)
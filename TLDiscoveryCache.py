@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""Keeps the result of the last broadcast discovery on disk, so it need not be repeated on every start."""
+
+from typing import Iterable, List, Set
+import json
+import os
+import time
+
+import TLActions
+from TLActions import TLSwitch, BROADCAST_IP, REGISTRY, tl_discover, tl_discover_all
+from TLPacket import TLPacket
+from TLTLVs import TLVTAGS
+
+CACHE_VERSION = 1  # type: int
+
+
+def default_path() -> str:
+    """Path of the cache file, following the XDG base directory specification."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')  # type: str
+    return os.path.join(base, 'tplink-easy-smart-switch', 'switches.json')
+
+
+def _tlv_text(packet: TLPacket, tag: str) -> str:
+    tlv = packet.get(TLVTAGS[tag])
+    return None if tlv is None else tlv.get_human_readable_value()
+
+
+class TLDiscoveryCache:
+    """The switches found by the last broadcast discovery. Entries older than max_age seconds are ignored."""
+
+    def __init__(self, path: str = None, max_age: float = 3600):
+        self.path = default_path() if path is None else path  # type: str
+        self.max_age = max_age  # type: float
+
+    def load(self) -> List[TLSwitch]:
+        """Returns the cached switches, an empty list if the cache is missing, broken or too old."""
+        try:
+            with open(self.path, 'r') as cache_file:
+                content = json.load(cache_file)
+
+            if content.get('version') != CACHE_VERSION or time.time() - content['discovered'] > self.max_age:
+                return []
+
+            return [TLSwitch(TLPacket(bytes.fromhex(entry['packet']))) for entry in content['switches']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return []
+
+    def save(self, switches: Iterable[TLSwitch]) -> None:
+        """Stores the switches found by a broadcast discovery that just finished."""
+        entries = []
+        for switch in switches:  # type: TLSwitch
+            packet = switch.source_packet  # type: TLPacket
+            entries.append({'mac': switch.mac.hex(':'),
+                            'ip': switch.ip4,
+                            'name': switch.name,
+                            'model': _tlv_text(packet, 'SYSINFO_HARD_VERSION'),
+                            'firmware': _tlv_text(packet, 'SYSINFO_FIRM_VERSION'),
+                            'packet': packet.to_byte_array().hex()})
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary = self.path + '.tmp'  # type: str
+            with open(temporary, 'w') as cache_file:
+                json.dump({'version': CACHE_VERSION, 'discovered': time.time(), 'switches': entries},
+                          cache_file, indent=1)
+            os.replace(temporary, self.path)
+        except OSError as error:
+            if TLActions.DEBUG:
+                print('Could not write discovery cache: {0}'.format(error))
+
+
+def cache_from_args(args) -> TLDiscoveryCache:
+    """The cache configured on the command line."""
+    return TLDiscoveryCache(args.cache_file, args.cache_age)
+
+
+def tl_discover_cached(cache: TLDiscoveryCache, target: str = BROADCAST_IP, duration: float = 1) -> TLSwitch:
+    """Like tl_discover, but a broadcast discovery ends as soon as every cached switch answered.
+    Only if one of them does not answer, or the cache is empty or too old, the full duration is waited for
+    and the cache is written anew."""
+    if target != BROADCAST_IP or cache is None or cache.max_age <= 0:
+        return tl_discover(target, duration)
+
+    macs = {switch.mac for switch in cache.load()}  # type: Set[bytes]
+
+    # A single pass for all cached switches. Without a cache, it is the full discovery.
+    found = tl_discover_all(BROADCAST_IP, duration, macs=macs or None)  # type: List[TLSwitch]
+
+    if macs and macs.issubset(switch.mac for switch in found):
+        if TLActions.DEBUG:
+            print('All {0:d} cached unit(s) answered, skipping the rest of the discovery.'.format(len(macs)))
+    else:
+        # Waited the full duration, everything that answers was found.
+        cache.save(REGISTRY)
+
+    if len(REGISTRY) == 1:
+        return REGISTRY[0]
+    else:
+        return None
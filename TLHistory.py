@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""History of port counters, to compute rates from the absolute counters the switches report."""
+
+from typing import Dict, List, Tuple
+from array import array
+from bisect import bisect_left, bisect_right
+import time
+
+from TLInfos import PortStatistics, PortStatisticsPort
+
+COUNTER_WRAP = 1 << 32  # type: int
+
+# Packets per second of a saturated gigabit port with minimum sized frames. A counter appearing to grow
+# faster than this did not wrap, it was reset by a reboot of the switch.
+MAX_PACKET_RATE = 1488096  # type: int
+
+COUNTERS = ('tx_good', 'tx_bad', 'rx_good', 'rx_bad')  # type: Tuple[str, ...]
+
+
+def counter_delta(old: int, new: int, elapsed: float, max_rate: float = MAX_PACKET_RATE) -> int:
+    """Difference between two readings of a 32-bit counter, taking wraparound and resets into account."""
+    if new >= old:
+        return new - old
+
+    wrapped = new + COUNTER_WRAP - old  # type: int
+    if wrapped <= max_rate * max(elapsed, 1):
+        return wrapped
+
+    # The counter started from zero again.
+    return new
+
+
+class CounterRing:
+    """Fixed-size ring buffer of timestamped counter samples of a single port.
+    Appending is O(1), the oldest sample is dropped when full. Timestamps must not decrease."""
+
+    def __init__(self, capacity: int = 360):
+        self.capacity = capacity  # type: int
+        self.timestamps = array('d', bytes(8 * capacity))  # type: array
+        self.counters = {name: array('I', bytes(4 * capacity)) for name in COUNTERS}  # type: Dict[str, array]
+        self._start = 0  # type: int
+        self._length = 0  # type: int
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _slot(self, index: int) -> int:
+        """Position of the index-th oldest sample in the arrays."""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('Sample {0:d} out of range.'.format(index))
+        return (self._start + index) % self.capacity
+
+    def append(self, timestamp: float, port: PortStatisticsPort) -> None:
+        """Stores the counters of the port."""
+        if self._length < self.capacity:
+            slot = (self._start + self._length) % self.capacity  # type: int
+            self._length += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+
+        self.timestamps[slot] = timestamp
+        for name in COUNTERS:
+            self.counters[name][slot] = getattr(port, name)
+
+    def timestamp(self, index: int) -> float:
+        """Time of the index-th oldest sample."""
+        return self.timestamps[self._slot(index)]
+
+    def counter(self, name: str, index: int) -> int:
+        """Value of counter name of the index-th oldest sample."""
+        return self.counters[name][self._slot(index)]
+
+    def range(self, start: float = None, end: float = None) -> Tuple[int, int]:
+        """Indices [first, last) of the samples taken between start and end, found by bisection."""
+        keys = _RingTimestamps(self)  # type: _RingTimestamps
+        first = 0 if start is None else bisect_left(keys, start)  # type: int
+        last = self._length if end is None else bisect_right(keys, end)  # type: int
+        return first, last
+
+    def delta(self, name: str, start: float = None, end: float = None,
+              max_rate: float = MAX_PACKET_RATE) -> Tuple[int, float]:
+        """Growth of counter name and the time elapsed between the first and the last sample in the range."""
+        first, last = self.range(start, end)
+        if last - first < 2:
+            return 0, 0.0
+
+        total = 0  # type: int
+        for index in range(first + 1, last):  # type: int
+            total += counter_delta(self.counter(name, index - 1), self.counter(name, index),
+                                   self.timestamp(index) - self.timestamp(index - 1), max_rate)
+
+        return total, self.timestamp(last - 1) - self.timestamp(first)
+
+    def rate(self, name: str, start: float = None, end: float = None) -> float:
+        """Packets per second of counter name in the range, by default over the whole history."""
+        total, elapsed = self.delta(name, start, end)
+        return total / elapsed if elapsed > 0 else 0.0
+
+    def error_rates(self, start: float = None, end: float = None) -> Tuple[float, float]:
+        """Share of bad packets among all packets sent and received in the range."""
+        result = []  # type: List[float]
+
+        for good, bad in (('tx_good', 'tx_bad'), ('rx_good', 'rx_bad')):
+            good_delta = self.delta(good, start, end)[0]  # type: int
+            bad_delta = self.delta(bad, start, end)[0]  # type: int
+            result.append(bad_delta / (good_delta + bad_delta) if good_delta + bad_delta else 0.0)
+
+        return result[0], result[1]
+
+
+class _RingTimestamps:
+    """Sequence view of the timestamps of a CounterRing in chronological order, for bisect."""
+
+    def __init__(self, ring: CounterRing):
+        self.ring = ring  # type: CounterRing
+
+    def __len__(self) -> int:
+        return len(self.ring)
+
+    def __getitem__(self, index: int) -> float:
+        return self.ring.timestamp(index)
+
+
+class TLCounterHistory:
+    """Bounded counter history of every port of every switch, keyed on switch MAC and port number."""
+
+    def __init__(self, capacity: int = 360):
+        self.capacity = capacity  # type: int
+        self.rings = {}  # type: Dict[Tuple[bytes, int], CounterRing]
+
+    def record(self, switchmac: bytes, stats: PortStatistics, timestamp: float = None) -> None:
+        """Stores a sample of all ports of the switch, taken now unless timestamp is given."""
+        timestamp = time.time() if timestamp is None else timestamp  # type: float
+
+        for port in stats.ports:  # type: PortStatisticsPort
+            ring = self.rings.get((switchmac, port.number))  # type: CounterRing
+            if ring is None:
+                ring = self.rings[(switchmac, port.number)] = CounterRing(self.capacity)
+            ring.append(timestamp, port)
+
+    def port(self, switchmac: bytes, number: int) -> CounterRing:
+        """The history of a single port, None if it was never recorded."""
+        return self.rings.get((switchmac, number))
+
+    def rates(self, switchmac: bytes, start: float = None, end: float = None) -> Dict[int, Dict[str, float]]:
+        """Packets per second of every counter of every port of the switch."""
+        return {number: {name: ring.rate(name, start, end) for name in COUNTERS}
+                for (mac, number), ring in self.rings.items() if mac == switchmac}
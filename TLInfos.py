@@ -1,12 +1,25 @@
 #!/usr/bin/env python3
 
-from typing import Tuple, List, Dict
-from struct import unpack
+from typing import Tuple, List, Dict, Iterable, Iterator, Union
+from array import array
+from itertools import compress
+from struct import Struct
 from TLPacket import TLPacket
 from TLTLVs import TLVTAGS, TLTLV
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 """Toolbox to store the state of the switch"""
 
+# Port number, enabled, current mode, tx good, tx bad, rx good, rx bad
+PORT_STATISTICS = Struct('>B?BIIII')  # type: Struct
+
+PORT_MODES = {0: "Link Down", 1: "Auto", 2: "10Half",
+              3: "10Full", 4: "100Half", 5: "100Full", 6: "1000Full"}  # type: Dict[int, str]
+
 
 class PortStatisticsPort:
     """Stats of a single port"""
@@ -20,24 +33,120 @@ class PortStatisticsPort:
         self.rx_bad = portstat[6]  # type: int
 
 
+def format_port(port: PortStatisticsPort) -> str:
+    """Formats the stats of a port as a row of the port statistics table"""
+    state = "enabled" if port.enabled else "disabled"  # type: str
+    mode = PORT_MODES.get(port.current_mode, "Unknown")  # type: str
+
+    return ('{0:>2d} {1:>8s} {2:>10s} {3:>10d} {4:>10d} {5:>10d} {6:>10d}'
+            .format(port.number, state, mode, port.tx_good, port.tx_bad, port.rx_good, port.rx_bad))
+
+
 class PortStatistics:
     """Stats of all port"""
     def __init__(self, packet: TLPacket):
         self.ports = []  # type: List[PortStatisticsPort]
 
-        for i in packet.tlvs:  # type: TLTLV
-            if i.tag == TLVTAGS['MONITOR_PORT_STATISTICS'] and len(i.value) == 19:
-                stat = PortStatisticsPort(unpack('>B?BIIII', i.value))  # type: PortStatisticsPort
+        for i in packet.get_all(TLVTAGS['MONITOR_PORT_STATISTICS']):  # type: TLTLV
+            if len(i.value) == 19:
+                stat = PortStatisticsPort(PORT_STATISTICS.unpack(i.value))  # type: PortStatisticsPort
                 self.ports.append(stat)
 
     def print_ports(self) -> None:
         """Prints the entire port statistic for all ports"""
-        modes = {0: "Link Down", 1: "Auto", 2: "10Half",
-                 3: "10Full", 4: "100Half", 5: "100Full", 6: "1000Full"}  # type: Dict[int, str]
-
         for i in self.ports:
-            state = "enabled" if i.enabled else "disabled"  # type: str
-            mode = modes.get(i.current_mode, "Unknown")  # type: str
+            print(format_port(i))
+
+
+CABLE_TEST_RESULTS = {0: 'no cable', 1: 'normal',
+                      2: 'open', 3: 'short',
+                      4: 'open and short', 5: 'cross-over'}  # type: Dict[int, str]
+
+
+class CableTestResult:
+    """Diagnosis of the cable attached to a single port"""
+    def __init__(self, value: bytes):
+        self.port = value[0]  # type: int
+        self.status = value[1]  # type: int
+        self.length = value[5]  # type: int
+
+    @property
+    def diagnosis(self) -> str:
+        """The status in words"""
+        return CABLE_TEST_RESULTS.get(self.status, 'unknown')
+
+
+def cable_test_results(packet: TLPacket) -> List[CableTestResult]:
+    """All cable diagnoses contained in the packet"""
+    return [CableTestResult(i.value) for i in packet.get_all(TLVTAGS['MONITOR_CABLE_TEST']) if len(i.value) == 6]
+
+
+class PortStatisticsColumns:
+    """Stats of many ports, possibly of many switches, stored as one array per field instead of one
+    object per port. Sums and filters run over whole columns."""
+
+    FIELDS = (('number', 'B'), ('enabled', 'B'), ('current_mode', 'B'),
+              ('tx_good', 'I'), ('tx_bad', 'I'), ('rx_good', 'I'), ('rx_bad', 'I'))  # type: Tuple[Tuple[str, str], ...]
+
+    def __init__(self, packet: TLPacket = None):
+        self.columns = {field: array(typecode) for field, typecode in self.FIELDS}  # type: Dict[str, array]
+
+        if packet is not None:
+            self.add(packet)
+
+    def __len__(self) -> int:
+        return len(self.columns['number'])
+
+    def __iter__(self) -> Iterator[PortStatisticsPort]:
+        """Yields every port as PortStatisticsPort, e.g. for presentation."""
+        for row in zip(*(self.columns[field] for field, _ in self.FIELDS)):
+            yield PortStatisticsPort((row[0], bool(row[1])) + row[2:])
+
+    def add(self, packet: TLPacket) -> None:
+        """Appends all ports of the port statistics packet, unpacked in a single pass."""
+        data = b''.join(i.value for i in packet.get_all(TLVTAGS['MONITOR_PORT_STATISTICS'])
+                        if len(i.value) == PORT_STATISTICS.size)  # type: bytes
+        rows = list(PORT_STATISTICS.iter_unpack(data))  # type: List[Tuple]
+
+        for position, (field, _) in enumerate(self.FIELDS):
+            self.columns[field].extend(row[position] for row in rows)
+
+    def column(self, field: str) -> Union[array, 'numpy.ndarray']:
+        """Returns the column of field. A NumPy array sharing its memory if NumPy is available."""
+        if numpy is not None:
+            return numpy.frombuffer(self.columns[field], dtype=numpy.dtype(self.columns[field].typecode))
+        return self.columns[field]
+
+    def sum(self, field: str) -> int:
+        """Sums up a counter over all ports."""
+        if numpy is not None:
+            return int(self.column(field).sum(dtype=numpy.uint64))
+        return sum(self.columns[field])
+
+    def link_up(self) -> Union[List[bool], 'numpy.ndarray']:
+        """Mask of the ports having a link. A NumPy boolean array if NumPy is available."""
+        if numpy is not None:
+            return self.column('current_mode') != 0
+        return [mode != 0 for mode in self.columns['current_mode']]
+
+    def with_errors(self) -> Union[List[bool], 'numpy.ndarray']:
+        """Mask of the ports having seen bad packets. A NumPy boolean array if NumPy is available."""
+        if numpy is not None:
+            return (self.column('tx_bad') != 0) | (self.column('rx_bad') != 0)
+        return [tx_bad or rx_bad for tx_bad, rx_bad in zip(self.columns['tx_bad'], self.columns['rx_bad'])]
+
+    def filter(self, mask: Union[Iterable[bool], 'numpy.ndarray']) -> 'PortStatisticsColumns':
+        """Returns a new instance containing only the ports selected by mask."""
+        result = PortStatisticsColumns()  # type: PortStatisticsColumns
+
+        if numpy is not None:
+            mask = numpy.asarray(mask if isinstance(mask, numpy.ndarray) else list(mask), dtype=bool)
+            for field, _ in self.FIELDS:
+                result.columns[field].frombytes(self.column(field)[mask].tobytes())
+            return result
+
+        mask = list(mask)  # type: List[bool]
+        for field, typecode in self.FIELDS:
+            result.columns[field] = array(typecode, compress(self.columns[field], mask))
 
-            print('{0:>2d} {1:>8s} {2:>10s} {3:>10d} {4:>10d} {5:>10d} {6:>10d}'
-                  .format(i.number, state, mode, i.tx_good, i.tx_bad, i.rx_good, i.rx_bad))
+        return result
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""Passively watches the management traffic on both ports the switches use.
+
+Both sockets wait in one selector. Every wakeup drains all datagrams pending on a socket. Output is buffered and
+written once per wakeup, and flushed at most every flush_interval seconds."""
+
+from typing import BinaryIO, Dict, List, TextIO, Union
+import ipaddress
+import json
+import selectors
+import socket
+import time
+
+from TLActions import PORTCS, PORTSC
+from TLCapture import TLCaptureDatagram, LOG_MAGIC, LOG_RECORD, packet_record
+from TLCrypt import tl_rc4_crypt_into
+from TLPacket import TLPacket
+
+FORMATS = ('text', 'json', 'binary')  # type: tuple
+
+# Large enough to absorb bursts while the output is written.
+RECEIVE_BUFFER_SIZE = 4 << 20  # type: int
+
+# Datagrams read from one socket per wakeup at most, so a flood on one port does not starve the other.
+MAX_BATCH = 1024  # type: int
+
+
+class TLListenerCounters:
+    """Traffic seen in one direction."""
+
+    def __init__(self):
+        self.packets = 0  # type: int
+        self.bytes = 0  # type: int
+        self.truncated = 0  # type: int
+        self.largest_batch = 0  # type: int
+
+    def __str__(self) -> str:
+        return '{0:d} packets, {1:d} bytes, {2:d} truncated, largest batch {3:d}'.format(
+            self.packets, self.bytes, self.truncated, self.largest_batch)
+
+
+class TLListener:
+    """Decodes every datagram sent to PORTCS or PORTSC and writes it to output.
+    text is the human readable form of TLPacket, json one line per packet and binary a log
+    of the encrypted datagrams, which tl_read_capture of TLCapture reads back.
+    output is a text stream for text and json, a binary one for binary."""
+
+    def __init__(self, output: Union[TextIO, BinaryIO], output_format: str = 'text', local_ip: str = '0.0.0.0',
+                 flush_interval: float = 0.5):
+        if output_format not in FORMATS:
+            raise ValueError('Unknown format {0}, choose one of {1}.'.format(output_format, ', '.join(FORMATS)))
+
+        self.output = output
+        self.output_format = output_format  # type: str
+        self.local_ip = local_ip  # type: str
+        self.flush_interval = flush_interval  # type: float
+
+        # Keyed on whether the datagrams were sent to a switch.
+        self.counters = {True: TLListenerCounters(),
+                         False: TLListenerCounters()}  # type: Dict[bool, TLListenerCounters]
+
+        self._selector = None  # type: selectors.BaseSelector
+        self._buffer = bytearray(65536)  # type: bytearray
+        self._flushed = 0.0  # type: float
+
+    def open(self) -> 'TLListener':
+        """Binds both ports."""
+        self._selector = selectors.DefaultSelector()
+
+        for port, to_switch in ((PORTCS, True), (PORTSC, False)):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            sock.bind((self.local_ip, port))
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, to_switch)
+
+        if self.output_format == 'binary':
+            try:
+                position = self.output.tell()  # type: int
+            except OSError:
+                # Pipes cannot tell, they are always new.
+                position = 0
+            if position == 0:
+                self.output.write(LOG_MAGIC)
+
+        return self
+
+    def close(self) -> None:
+        """Writes what is still buffered and closes both sockets."""
+        self.output.flush()
+
+        if self._selector is not None:
+            for key in list(self._selector.get_map().values()):
+                self._selector.unregister(key.fileobj)
+                key.fileobj.close()
+            self._selector.close()
+            self._selector = None
+
+    def __enter__(self) -> 'TLListener':
+        return self.open()
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _drain(self, sock: socket.socket, to_switch: bool, now: float, output: List) -> None:
+        """Reads everything pending on the socket, up to MAX_BATCH datagrams, all stamped with the time now."""
+        counters = self.counters[to_switch]  # type: TLListenerCounters
+        view = memoryview(self._buffer)  # type: memoryview
+        received = 0  # type: int
+
+        while received < MAX_BATCH:
+            try:
+                length, (source, source_port) = sock.recvfrom_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+
+            received += 1
+            counters.packets += 1
+            counters.bytes += length
+            source = ipaddress.IPv4Address(source).packed  # type: bytes
+
+            if self.output_format == 'binary':
+                # Logged still encrypted, it is decrypted when read back.
+                output.append(LOG_RECORD.pack(now, to_switch, source, source_port, length))
+                output.append(bytes(view[:length]))
+                continue
+
+            tl_rc4_crypt_into(view[:length])
+            packet = TLPacket(view[:length])  # type: TLPacket
+
+            if self.output_format == 'json':
+                datagram = TLCaptureDatagram(now, source, bytes(4), source_port,
+                                             PORTCS if to_switch else PORTSC, b'')  # type: TLCaptureDatagram
+                output.append(json.dumps(packet_record(datagram, packet)) + '\n')
+            elif to_switch:
+                output.append('\u001B[91m-----> Computer to switch\n{0}'
+                              '\n<----- Computer to switch\n\u001B[0m\n'.format(str(packet)))
+            else:
+                output.append('\u001B[94m-----> Switch to computer\n{0}'
+                              '\n<----- Switch to computer\n\u001B[0m\n'.format(str(packet)))
+
+            counters.truncated += packet.truncated
+
+        counters.largest_batch = max(counters.largest_batch, received)
+
+    def poll(self, timeout: float = None) -> int:
+        """Waits up to timeout seconds for traffic and handles all of it. Returns the number of datagrams."""
+        output = []  # type: List
+        before = self.packets  # type: int
+
+        ready = self._selector.select(timeout)
+        now = time.time()  # type: float
+        for key, _ in ready:
+            self._drain(key.fileobj, key.data, now, output)
+
+        if output:
+            self.output.write((b'' if self.output_format == 'binary' else '').join(output))
+
+        if time.monotonic() - self._flushed >= self.flush_interval:
+            self.output.flush()
+            self._flushed = time.monotonic()
+
+        return self.packets - before
+
+    @property
+    def packets(self) -> int:
+        return sum(counters.packets for counters in self.counters.values())
+
+    def run(self, duration: float = None) -> None:
+        """Listens for duration seconds, or until interrupted if None."""
+        end = None if duration is None else time.monotonic() + duration  # type: float
+
+        while end is None or time.monotonic() < end:
+            timeout = self.flush_interval  # type: float
+            if end is not None:
+                timeout = max(0.0, min(timeout, end - time.monotonic()))
+            self.poll(timeout)
@@ -2,10 +2,15 @@
 
 """TP-Link packet parser"""
 
-from typing import List, Dict
-from struct import unpack
+from typing import List, Dict, Iterator, Union
+from struct import Struct
 from TLTLVs import TLTLV
 
+HEADER = Struct('>BB6s6sHIHHHHI')  # type: Struct
+TLV_HEADER = Struct('>HH')  # type: Struct
+SEQUENCE_NUMBER = Struct('>H')  # type: Struct
+SEQUENCE_NUMBER_OFFSET = 14  # type: int
+
 
 TLERRORCODES = {
     0: 'SYS_OK',
@@ -58,7 +63,9 @@ TLERRORCODES = {
     7513: 'ERR_VLAN_ENTRY_DUPLICATE',
     7514: 'ERR_VLAN_TYPE',
     7515: 'ERR_VLAN_MTU_LAG_MUTEX'
-}
+}  # type: Dict[int, str]
+
+TLERRORNAMES = {readable: numeric for (numeric, readable) in TLERRORCODES.items()}  # type: Dict[str, int]
 
 
 class TLPacket:
@@ -66,38 +73,99 @@ class TLPacket:
 
     OPCODES = {'DISCOVER': 0, 'GET': 1, 'SET': 3}  # type: Dict[str, int]
 
-    def __init__(self, decrypted: bytes = None):
+    def __init__(self, decrypted: Union[bytes, bytearray, memoryview] = None):
+        self.truncated = False  # type: bool
+        self._raw = None  # type: bytes
+        self._tlvs = None  # type: List[TLTLV]
+        self._index = None  # type: Dict[int, List[TLTLV]]
+        self._indexed = 0  # type: int
+
+        # Also the header of datagrams too short to hold one, those are marked truncated.
+        self.version = 1  # type: int
+        self.opcode = self.OPCODES['DISCOVER']  # type: int
+        self.mac_switch = b'\x00\x00\x00\x00\x00\x00'  # type: bytes
+        self.mac_computer = b'\x00\x00\x00\x00\x00\x00'  # type: bytes
+        self.sequence_number = 0  # type: int
+        self.error_code = 0  # type: int
+        self.length = 0  # type: int
+        self.fragment = 0  # type: int
+        self.flags = 0  # type: int
+        self.token = 0  # type: int
+        self.checksum = 0  # type: int
+
         if decrypted is None:
-            self.version = 1  # type: int
-            self.opcode = self.OPCODES['DISCOVER']  # type: int
-            self.mac_switch = b'\x00\x00\x00\x00\x00\x00'  # type: bytes
-            self.mac_computer = b'\x00\x00\x00\x00\x00\x00'  # type: bytes
-            self.sequence_number = 0  # type: int
-            self.error_code = 0  # type: int
-            self.length = 0  # type: int
-            self.fragment = 0  # type: int
-            self.flags = 0  # type: int
-            self.token = 0  # type: int
-            self.checksum = 0  # type: int
-
-            self.tlvs = []  # type: List[TLTLV]
-        elif len(decrypted) >= 32:
+            self.tlvs = []
+        elif len(decrypted) >= HEADER.size:
+            # The only copy made. Receive buffers get reused, the packet must own its data.
+            self._raw = bytes(decrypted)
+
             [self.version, self.opcode, self.mac_switch,
              self.mac_computer, self.sequence_number,
              self.error_code, self.length, self.fragment,
-             self.flags, self.token, self.checksum] = unpack('>BB6s6sHIHHHHI', decrypted[:32])
-
-            body = decrypted[32:]  # type: bytes
-
-            self.tlvs = []  # type: List[TLTLV]
-            while len(body) > 3:
-                ntlv = TLTLV()  # type: TLTLV
-                ntlv.tag, ntlv.length = unpack('>HH', body[:4])
-                if len(body) >= ntlv.length + 4:
-                    ntlv.value = bytes(body[4:ntlv.length + 4])
-                    body = body[ntlv.length + 4:]
-
-                self.tlvs.append(ntlv)
+             self.flags, self.token, self.checksum] = HEADER.unpack_from(self._raw)
+        else:
+            self.truncated = True
+            self.tlvs = []
+
+    @property
+    def tlvs(self) -> List[TLTLV]:
+        """The TLVs of the packet. Parsed on first access."""
+        if self._tlvs is None:
+            self._tlvs = list(self.iter_tlvs())
+        return self._tlvs
+
+    @tlvs.setter
+    def tlvs(self, tlvs: List[TLTLV]) -> None:
+        self._tlvs = tlvs
+        self._index = None
+
+    def _tag_index(self) -> Dict[int, List[TLTLV]]:
+        """Maps each tag to its TLVs in packet order. Built on first use, rebuilt when TLVs were added."""
+        tlvs = self.tlvs  # type: List[TLTLV]
+
+        if self._index is None or self._indexed != len(tlvs):
+            self._index = {}
+            for tlv in tlvs:  # type: TLTLV
+                self._index.setdefault(tlv.tag, []).append(tlv)
+            self._indexed = len(tlvs)
+
+        return self._index
+
+    def get(self, tag: int) -> TLTLV:
+        """Returns the first TLV with the tag, None if there is none."""
+        found = self._tag_index().get(tag)  # type: List[TLTLV]
+        return None if found is None else found[0]
+
+    def get_all(self, tag: int) -> List[TLTLV]:
+        """Returns all TLVs with the tag."""
+        return self._tag_index().get(tag, [])
+
+    def iter_tlvs(self) -> Iterator[TLTLV]:
+        """Walks the TLVs of the received packet without copying anything but the values.
+        Stops and sets truncated, if a TLV claims to be longer than what is left of the packet.
+        truncated is therefore only meaningful once the TLVs were parsed."""
+        if self._tlvs is not None or self._raw is None:
+            yield from self.tlvs
+            return
+
+        raw = self._raw  # type: bytes
+        end = len(raw)  # type: int
+        offset = HEADER.size  # type: int
+
+        while end - offset >= TLV_HEADER.size:
+            tag, length = TLV_HEADER.unpack_from(raw, offset)
+            offset += TLV_HEADER.size
+
+            if offset + length > end:
+                self.truncated = True
+                return
+
+            ntlv = TLTLV(tag)  # type: TLTLV
+            ntlv.value = raw[offset:offset + length]
+            ntlv.length = length
+            offset += length
+
+            yield ntlv
 
     def __str__(self) -> str:
         """Converts TLPacket to human readable summary."""
@@ -125,38 +193,44 @@ class TLPacket:
                       str(self.token),
                       str(self.checksum)))
 
-        for tlv in self.tlvs:  # type: TLTLV
+        tlvs = self.tlvs  # type: List[TLTLV]
+        if self.truncated:
+            result += 'Truncated:       True\n'
+
+        for tlv in tlvs:  # type: TLTLV
             result += '\nTag {0} ({1})\nLength {2}\nValue: {3}\n'.format(str(tlv.tag), tlv.get_human_readable_tag(),
                                                                          str(tlv.length),
                                                                          tlv.get_human_readable_value())
 
         return result
 
-    def to_byte_array(self) -> bytearray:
-        """Serialize the packet described by this instance to bytearray to send it to the switch"""
-        header = bytearray()  # type: bytearray
-        body = bytearray()  # type: bytearray
-
-        header.extend(self.version.to_bytes(1, 'big'))
-        header.extend(self.opcode.to_bytes(1, 'big'))
-        header.extend(self.mac_switch)
-        header.extend(self.mac_computer)
-        header.extend(self.sequence_number.to_bytes(2, 'big'))
-
-        header.extend(self.error_code.to_bytes(4, 'big'))
-        header.extend(self.length.to_bytes(2, 'big'))
-        header.extend(self.fragment.to_bytes(2, 'big'))
-        header.extend(self.flags.to_bytes(2, 'big'))
-        header.extend(self.token.to_bytes(2, 'big'))
-        header.extend(self.checksum.to_bytes(4, 'big'))
+    def size(self) -> int:
+        """Length of the serialized packet in bytes."""
+        return HEADER.size + sum(TLV_HEADER.size + len(i.value) for i in self.tlvs)
+
+    def serialize_into(self, buffer: Union[bytearray, memoryview], offset: int = 0) -> int:
+        """Serialize the packet into buffer at offset, e.g. a send buffer to be encrypted in place.
+        Updates length and returns it."""
+        self.length = self.size()
+
+        if len(buffer) - offset < self.length:
+            raise ValueError('Buffer too small for packet: {0:d} < {1:d}'.format(len(buffer) - offset, self.length))
+
+        HEADER.pack_into(buffer, offset, self.version, self.opcode, self.mac_switch, self.mac_computer,
+                         self.sequence_number, self.error_code, self.length, self.fragment,
+                         self.flags, self.token, self.checksum)
+        position = offset + HEADER.size  # type: int
 
         for i in self.tlvs:
-            body.extend(i.tag.to_bytes(2, 'big'))
-            body.extend(i.length.to_bytes(2, 'big'))
-            body.extend(i.value)
+            TLV_HEADER.pack_into(buffer, position, i.tag, i.length)
+            position += TLV_HEADER.size
+            buffer[position:position + len(i.value)] = i.value
+            position += len(i.value)
 
-        self.length = len(header) + len(body)
-        header[20] = self.length.to_bytes(2, 'big')[0]
-        header[21] = self.length.to_bytes(2, 'big')[1]
+        return self.length
 
-        return header + body
+    def to_byte_array(self) -> bytearray:
+        """Serialize the packet described by this instance to bytearray to send it to the switch"""
+        result = bytearray(self.size())  # type: bytearray
+        self.serialize_into(result)
+        return result
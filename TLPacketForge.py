@@ -2,23 +2,29 @@
 
 """Module to create common packets understood and used by TP-Link software and firmware"""
 
+from typing import Any, Callable, Tuple
+from collections import OrderedDict
 from random import randint
 from struct import pack
+import threading
 
-from TLPacket import TLPacket
+from TLCrypt import tl_rc4_crypt_at, tl_rc4_crypt_into
+from TLPacket import TLPacket, SEQUENCE_NUMBER, SEQUENCE_NUMBER_OFFSET
+from TLSequence import SEQUENCE_NUMBERS
 from TLTLVs import TLTLV, TLVTAGS
 
 
 def forge_common_packet(opcode: int, switch_mac: bytes = b'\x00\x00\x00\x00\x00\x00',
                         computer_mac: bytes = b'\x00\x00\x00\x00\x00\x00', token: int = 0) -> TLPacket:
-    """Creates package stub with commonly used parameters and a random sequence number."""
+    """Creates package stub with commonly used parameters and a random sequence number.
+    Clients replace the sequence number by one of their TLSequenceAllocator when sending."""
 
     packet = TLPacket()  # type: TLPacket
     packet.version = 1
     packet.opcode = opcode
     packet.mac_switch = switch_mac
     packet.mac_computer = computer_mac
-    packet.sequence_number = randint(0, 1000)
+    packet.sequence_number = randint(0, SEQUENCE_NUMBERS - 1)
     packet.error_code = 0
     packet.length = 0
     packet.fragment = 0
@@ -123,8 +129,39 @@ def forge_get_qos(switch_mac: bytes, token: int) -> bytes:
     return bytes(packet.to_byte_array())
 
 
-def forge_question(switch_mac: bytes, token: int, tag: int) -> TLPacket:
-    """Gets PHY stats of all ports."""
+def forge_backup(switch_mac: bytes, token: int) -> bytes:
+    """Asks for the configuration file."""
+
+    packet = forge_common_packet(TLPacket.OPCODES['GET'],
+                                 switch_mac, b'\x00\x00\x00\x00\x00\x00', token)  # type: TLPacket
+
+    tlv = TLTLV(TLVTAGS['SYSCFG_BACKUP_FILE'])  # type: TLTLV
+    packet.tlvs.append(tlv)
+
+    end_tlv_list(packet)
+
+    return bytes(packet.to_byte_array())
+
+
+def forge_restore_fragment(switch_mac: bytes, token: int, user: str, password: str,
+                           chunk: bytes, fragment: int, last: bool) -> TLPacket:
+    """One datagram of a configuration file upload. Like replies, the file is split into fragments
+    numbered from 0, the last one ends with the EOT TLV."""
+
+    packet = forge_authorized_packet(switch_mac, token, user, password)  # type: TLPacket
+    packet.fragment = fragment
+
+    tlv = TLTLV(TLVTAGS['SYSCFG_RESTORE_FILE'], chunk)  # type: TLTLV
+    packet.tlvs.append(tlv)
+
+    if last:
+        end_tlv_list(packet)
+
+    return packet
+
+
+def forge_question(switch_mac: bytes, token: int, tag: int) -> bytearray:
+    """Asks for the value of any tag."""
 
     packet = forge_common_packet(TLPacket.OPCODES['GET'],
                                  switch_mac, b'\x00\x00\x00\x00\x00\x00', token)  # type: TLPacket
@@ -135,3 +172,42 @@ def forge_question(switch_mac: bytes, token: int, tag: int) -> TLPacket:
     end_tlv_list(packet)
 
     return packet.to_byte_array()
+
+
+class TLTemplateCache(threading.local):
+    """Keeps the encrypted datagrams created by forge functions. As the keystream is fixed, a request
+    sent again only needs the encrypted bytes of its new sequence number to be patched in.
+    The templates are patched in place, so each thread has its own."""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize  # type: int
+        self._templates = OrderedDict()  # type: OrderedDict[Tuple[Callable[..., bytes], Tuple[Any, ...]], bytearray]
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def clear(self) -> None:
+        """Forgets all templates."""
+        self._templates.clear()
+
+    def datagram(self, sequence_number: int, forge: Callable[..., bytes], *args: Any) -> bytearray:
+        """Returns the encrypted request forge(*args) carrying sequence_number, ready to be sent.
+        The datagram is the cached template itself, it is only valid until the next call for the same request."""
+        key = (forge, args)  # type: Tuple[Callable[..., bytes], Tuple[Any, ...]]
+        template = self._templates.get(key)  # type: bytearray
+
+        if template is None:
+            template = bytearray(forge(*args))
+            tl_rc4_crypt_into(template)
+            self._templates[key] = template
+
+            if len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        else:
+            self._templates.move_to_end(key)
+
+        tl_rc4_crypt_at(template, SEQUENCE_NUMBER_OFFSET, SEQUENCE_NUMBER.pack(sequence_number))
+        return template
+
+
+REQUEST_TEMPLATES = TLTemplateCache()  # type: TLTemplateCache
@@ -15,15 +15,21 @@ def present_discovery(packet: TLPacket) -> None:
     fwversion = ...  # type: str
     ip4 = ...  # type: str
 
-    for tlv in packet.tlvs:
-        if tlv.tag == TLVTAGS['SYSINFO_HARD_VERSION']:
-            model = tlv.get_human_readable_value()
-        elif tlv.tag == TLVTAGS['SYSINFO_DESCRIPTION']:
-            name = tlv.get_human_readable_value()
-        elif tlv.tag == TLVTAGS['SYSINFO_FIRM_VERSION']:
-            fwversion = tlv.get_human_readable_value()
-        elif tlv.tag == TLVTAGS['SYSINFO_IP']:
-            ip4 = tlv.get_human_readable_value()
+    tlv = packet.get(TLVTAGS['SYSINFO_HARD_VERSION'])  # type: TLTLV
+    if tlv is not None:
+        model = tlv.get_human_readable_value()
+
+    tlv = packet.get(TLVTAGS['SYSINFO_DESCRIPTION'])
+    if tlv is not None:
+        name = tlv.get_human_readable_value()
+
+    tlv = packet.get(TLVTAGS['SYSINFO_FIRM_VERSION'])
+    if tlv is not None:
+        fwversion = tlv.get_human_readable_value()
+
+    tlv = packet.get(TLVTAGS['SYSINFO_IP'])
+    if tlv is not None:
+        ip4 = tlv.get_human_readable_value()
 
     print('{0:31s} {1:15s} {2:31s} {3:10s}'.format(name, ip4, model, fwversion))
 
@@ -35,15 +41,9 @@ def present_port_statistics(packet: TLPacket) -> None:
 
 
 def present_cable_test(packet: TLPacket) -> None:
-    possible_test_results = {0: 'no cable', 1: 'normal',
-                             2: 'open', 3: 'short',
-                             4: 'open and short', 5: 'cross-over'}  # type: Dict[int, str]
-
-    for i in packet.tlvs:
-        if i.tag == TLVTAGS['MONITOR_CABLE_TEST'] and len(i.value) == 6:
-            print('Port {0:2d}: Length {1:3d}m, Diagnosis: {2:14s}'
-                  .format(i.value[0], i.value[5],
-                          possible_test_results.get(i.value[1], 'unknown')))
+    for result in cable_test_results(packet):
+        print('Port {0:2d}: Length {1:3d}m, Diagnosis: {2:14s}'
+              .format(result.port, result.length, result.diagnosis))
 
 
 def present_qos(packet: TLPacket) -> None:
@@ -51,7 +51,7 @@ def present_qos(packet: TLPacket) -> None:
 
     print('{0:2s} {1:8s}'.format('#', 'Priority'))
 
-    for tlv in packet.tlvs:
-        if tlv.tag == TLVTAGS['QOS_BASIC_PRIORITY'] and len(tlv.value) == 2:
+    for tlv in packet.get_all(TLVTAGS['QOS_BASIC_PRIORITY']):
+        if len(tlv.value) == 2:
             print('{0:2d} {1:8s}'
                   .format(tlv.value[0], possible_qos_modes.get(tlv.value[1], 'unknown')))
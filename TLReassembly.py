@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Reassembly of replies spread over several datagrams.
+
+All datagrams of a reply carry the sequence number of the request. The fragment field holds the index
+of the datagram within the reply, the last one ends with the EOT TLV."""
+
+from typing import Dict, Iterator, List, Set
+
+from TLPacket import TLPacket
+from TLTLVs import TLTLV, TLVTAGS
+
+
+class TLReassemblyError(Exception):
+    """The reply exceeded the limits of the reassembly, or did not arrive completely."""
+
+
+class TLReassembly:
+    """Collects the fragments of one reply. Memory is bounded by max_fragments and max_bytes.
+    TLVs can either be taken as one packet once complete, or streamed in order as fragments arrive,
+    in which case every fragment is dropped as soon as its TLVs were handed out."""
+
+    def __init__(self, max_fragments: int = 256, max_bytes: int = 1 << 20):
+        self.max_fragments = max_fragments  # type: int
+        self.max_bytes = max_bytes  # type: int
+
+        self.first = None  # type: TLPacket
+        self.last = None  # type: int
+        self.received = 0  # type: int
+        self.size = 0  # type: int
+        self.truncated = False  # type: bool
+
+        self._fragments = {}  # type: Dict[int, TLPacket]
+        # Indexes of all fragments taken, including those already handed out.
+        self._indexes = set()  # type: Set[int]
+        self._next = 0  # type: int
+
+    @property
+    def complete(self) -> bool:
+        """Whether every fragment from 0 up to the one with the EOT TLV arrived."""
+        # Fragments beyond the last one are never kept, so this counts exactly the indexes up to it.
+        return self.last is not None and len(self._indexes) == self.last + 1
+
+    def add(self, packet: TLPacket) -> bool:
+        """Stores the fragment. Returns False for duplicates and fragments beyond the last one.
+        Raises TLReassemblyError if the reply grows beyond the limits."""
+        index = packet.fragment  # type: int
+
+        if index < self._next or index in self._indexes or (self.last is not None and index > self.last):
+            return False
+
+        if index >= self.max_fragments:
+            raise TLReassemblyError('Reply exceeds {0:d} fragments.'.format(self.max_fragments))
+
+        is_last = packet.get(TLVTAGS['EOT']) is not None  # type: bool
+        if is_last and self.last is not None:
+            # Only one fragment can be the last.
+            return False
+
+        self._indexes.add(index)
+        # Counted from the TLVs, the length in the header is whatever the sender claims.
+        self.size += packet.size()
+        if self.size > self.max_bytes:
+            raise TLReassemblyError('Reply exceeds {0:d} bytes.'.format(self.max_bytes))
+
+        if index == 0:
+            self.first = packet
+        if is_last:
+            self.last = index
+            # Fragments that claimed to come later were bogus.
+            for later in [i for i in self._indexes if i > index]:
+                self._indexes.remove(later)
+                self.size -= self._fragments.pop(later).size()
+        self.truncated = self.truncated or packet.truncated
+        self.received = len(self._indexes)
+
+        self._fragments[index] = packet
+        return True
+
+    def ready_tlvs(self) -> Iterator[TLTLV]:
+        """Yields the TLVs of all fragments that arrived in order so far and forgets those fragments."""
+        while self._next in self._fragments:
+            packet = self._fragments.pop(self._next)  # type: TLPacket
+            self._next += 1
+            yield from packet.tlvs
+
+    def packet(self) -> TLPacket:
+        """Combines all fragments into one packet with the header of the first one."""
+        result = TLPacket()  # type: TLPacket
+        first = self.first if self.first is not None else self._fragments[min(self._fragments)]  # type: TLPacket
+
+        for field in ('version', 'opcode', 'mac_switch', 'mac_computer', 'sequence_number',
+                      'error_code', 'token', 'checksum'):
+            setattr(result, field, getattr(first, field))
+
+        tlvs = []  # type: List[TLTLV]
+        for index in sorted(self._fragments):
+            tlvs.extend(self._fragments[index].tlvs)
+
+        result.tlvs = tlvs
+        result.truncated = self.truncated or not self.complete
+        result.length = result.size()
+
+        return result
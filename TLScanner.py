@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+"""Scans a switch for the TLV tags it answers to.
+
+Many probes are in flight at once, all asked with the same token. The number in flight follows the observed
+loss: it grows by one per round trip while answers arrive and is halved when the loss rate gets too high. Progress is
+checkpointed to disk, so an interrupted scan resumes where it stopped."""
+
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Set, Tuple
+import asyncio
+import json
+import os
+import time
+
+from TLActions import TLSwitch, PORTCS
+from TLAsync import TLAsyncClient
+from TLPacket import TLPacket, TLERRORCODES, TLERRORNAMES
+from TLPacketForge import forge_question, TLTemplateCache
+from TLTLVs import TLVNAMES
+
+CHECKPOINT_VERSION = 1  # type: int
+
+# Weight of the latest probe in the loss rate, and the loss rate above which lost probes shrink the window.
+# Below it, losses are taken as noise and only retried.
+LOSS_WEIGHT = 0.05  # type: float
+LOSS_TARGET = 0.1  # type: float
+
+# Probes lost in a row, with only one in flight, before the token is fetched again.
+# This also checks whether the switch is still there.
+STALL = 8  # type: int
+
+
+class TLScanError(Exception):
+    """The switch stopped answering during a scan."""
+
+
+class TLScanCheckpoint:
+    """Progress of a scan: every tag below next is done, as are the tags in done."""
+
+    def __init__(self, path: str):
+        self.path = path  # type: str
+
+    def load(self, switchmac: bytes, first: int, last: int) -> Tuple[int, Set[int]]:
+        """Returns next and done of an earlier scan of the same switch and range, None if there is none."""
+        try:
+            with open(self.path, 'r') as checkpoint_file:
+                content = json.load(checkpoint_file)
+
+            if (content.get('version') != CHECKPOINT_VERSION or content['mac'] != switchmac.hex(':') or
+                    content['first'] != first or content['last'] != last):
+                return None
+
+            return content['next'], set(content['done'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, switchmac: bytes, first: int, last: int, next_tag: int, done: Set[int]) -> None:
+        temporary = self.path + '.tmp'  # type: str
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump({'version': CHECKPOINT_VERSION, 'mac': switchmac.hex(':'), 'first': first, 'last': last,
+                       'next': next_tag, 'done': sorted(done)}, checkpoint_file)
+        os.replace(temporary, self.path)
+
+
+def tag_record(tag: int, packet: TLPacket) -> Dict[str, Any]:
+    """The answer to a probe as it is written to the scan output."""
+    return {'tag': tag,
+            'name': TLVNAMES.get(tag),
+            'error': packet.error_code,
+            'error_name': TLERRORCODES.get(packet.error_code),
+            'values': [tlv.value.hex() for tlv in packet.get_all(tag) if tlv.value is not None]}
+
+
+class TLTagScanner:
+    """Asks the switch for the value of every tag from first to last.
+    before_save is called before every checkpoint save, to make the answers taken so far durable first."""
+
+    def __init__(self, client: TLAsyncClient, switch: TLSwitch, first: int = 1, last: int = 65534,
+                 window: int = 16, max_window: int = 256, timeout: float = 0.3, retries: int = 2,
+                 checkpoint: TLScanCheckpoint = None, checkpoint_interval: float = 5,
+                 before_save: Callable[[], None] = None):
+        self.client = client  # type: TLAsyncClient
+        self.switch = switch  # type: TLSwitch
+        self.first = first  # type: int
+        self.last = last  # type: int
+        self.max_window = max_window  # type: int
+        self.timeout = timeout  # type: float
+        self.retries = retries  # type: int
+        self.checkpoint = checkpoint  # type: TLScanCheckpoint
+        self.checkpoint_interval = checkpoint_interval  # type: float
+        self.before_save = before_save  # type: Callable[[], None]
+
+        self.window = float(window)  # type: float
+        self.loss = 0.0  # type: float
+        self.token = None  # type: int
+        self.next = first  # type: int
+        self.done = set()  # type: Set[int]
+
+        self.answered = 0  # type: int
+        self.lost = 0  # type: int
+        self.unanswered = 0  # type: int
+
+        # Retried probes are sent from their template again, other tags need not be kept.
+        self._templates = TLTemplateCache(2 * max_window)  # type: TLTemplateCache
+        self._decreased = 0.0  # type: float
+        self._stalled = 0  # type: int
+
+    @property
+    def remaining(self) -> int:
+        return self.last + 1 - self.next - len(self.done)
+
+    def _complete(self, tag: int) -> None:
+        self.done.add(tag)
+        while self.next in self.done:
+            self.done.remove(self.next)
+            self.next += 1
+
+    def _probe_answered(self) -> None:
+        self.answered += 1
+        self._stalled = 0
+        self.loss *= 1 - LOSS_WEIGHT
+        self.window = min(self.max_window, self.window + 1 / self.window)
+
+    def _probe_lost(self) -> None:
+        self.lost += 1
+        self._stalled += 1
+        self.loss = self.loss * (1 - LOSS_WEIGHT) + LOSS_WEIGHT
+
+        # Probes lost in the same burst only halve the window once.
+        now = time.monotonic()  # type: float
+        if self.loss > LOSS_TARGET and now - self._decreased >= self.timeout:
+            self.window = max(1.0, self.window / 2)
+            self._decreased = now
+
+    async def _refresh_token(self) -> None:
+        self.token = None
+        for _ in range(self.retries + 1):
+            self.token = await self.client.get_token(self.switch.mac, self.switch.ip4, self.timeout)
+            if self.token is not None:
+                break
+
+        self._stalled = 0
+        if self.token is None:
+            raise TLScanError('{0} does not hand out a token.'.format(self.switch.ip4))
+
+    async def _probe(self, tag: int) -> TLPacket:
+        token = self.token  # type: int
+
+        def send(sequence_number: int) -> None:
+            self.client.transport.sendto(
+                self._templates.datagram(sequence_number, forge_question, self.switch.mac, token, tag),
+                (self.switch.ip4, PORTCS))
+
+        return await self.client.exchange(send, self.switch.mac, self.timeout)
+
+    def save(self) -> None:
+        """Writes the progress to the checkpoint, if any."""
+        if self.checkpoint is not None:
+            if self.before_save is not None:
+                self.before_save()
+            self.checkpoint.save(self.switch.mac, self.first, self.last, self.next, self.done)
+
+    async def scan(self) -> AsyncIterator[Tuple[int, TLPacket]]:
+        """Yields tag and answer of every probe the switch answered, in the order the answers arrive.
+        Progress is saved only after the consumer took the answers, so a resumed scan never loses one.
+        Raises TLScanError if the switch stops answering."""
+        if self.checkpoint is not None:
+            resumed = self.checkpoint.load(self.switch.mac, self.first, self.last)
+            if resumed is not None:
+                self.next, self.done = resumed
+
+        todo = deque(tag for tag in range(self.next, self.last + 1) if tag not in self.done)  # type: Deque[int]
+        attempts = {}  # type: Dict[int, int]
+        running = {}  # type: Dict[asyncio.Future, int]
+        saved = time.monotonic()  # type: float
+
+        await self._refresh_token()
+
+        try:
+            while todo or running:
+                while todo and len(running) < int(self.window):
+                    tag = todo.popleft()  # type: int
+                    running[asyncio.ensure_future(self._probe(tag))] = tag
+
+                finished = (await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED))[0]
+                answers = []  # type: List[Tuple[int, TLPacket]]
+                token_rejected = False
+
+                for future in finished:
+                    tag = running.pop(future)
+                    packet = future.result()  # type: TLPacket
+
+                    if packet is None:
+                        self._probe_lost()
+                        attempts[tag] = attempts.get(tag, 0) + 1
+                        if attempts[tag] <= self.retries:
+                            todo.appendleft(tag)
+                        else:
+                            attempts.pop(tag)
+                            self.unanswered += 1
+                            self._complete(tag)
+                    elif packet.error_code == TLERRORNAMES['ERR_TOKEN_ERROR']:
+                        token_rejected = True
+                        todo.appendleft(tag)
+                    else:
+                        self._probe_answered()
+                        attempts.pop(tag, None)
+                        answers.append((tag, packet))
+
+                for tag, packet in answers:
+                    yield tag, packet
+                    self._complete(tag)
+
+                if token_rejected or (self._stalled >= STALL and self.window <= 1):
+                    await self._refresh_token()
+
+                if time.monotonic() - saved >= self.checkpoint_interval:
+                    self.save()
+                    saved = time.monotonic()
+        finally:
+            for future in running:
+                future.cancel()
+            self.save()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""Allocation of sequence numbers and matching of replies to the requests waiting for them."""
+
+from typing import Callable, Dict
+from random import randint
+import threading
+
+from TLPacket import TLPacket
+
+SEQUENCE_NUMBERS = 0x10000  # type: int
+
+# Gets every reply carrying the sequence number of its request. Returns whether it accepted the reply.
+Waiter = Callable[[TLPacket], bool]
+
+
+class TLSequenceAllocator:
+    """Hands out sequence numbers from the whole 16-bit space and keeps the table of requests in flight.
+
+    Numbers are given out in ascending order starting at a random offset, so a late reply to a request
+    that already timed out does not match the next request. A number is never given out twice while
+    its request is still in flight."""
+
+    def __init__(self, start: int = None):
+        self._next = randint(0, SEQUENCE_NUMBERS - 1) if start is None else start % SEQUENCE_NUMBERS  # type: int
+        self._in_flight = {}  # type: Dict[int, Waiter]
+        self._lock = threading.Lock()  # type: threading.Lock
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+    def __contains__(self, sequence_number: int) -> bool:
+        return sequence_number in self._in_flight
+
+    def allocate(self, waiter: Waiter) -> int:
+        """Reserves a free sequence number for a new request whose replies go to waiter."""
+        with self._lock:
+            if len(self._in_flight) >= SEQUENCE_NUMBERS:
+                raise RuntimeError('All {0:d} sequence numbers are in flight.'.format(SEQUENCE_NUMBERS))
+
+            while self._next in self._in_flight:
+                self._next = (self._next + 1) % SEQUENCE_NUMBERS
+
+            sequence_number = self._next  # type: int
+            self._next = (self._next + 1) % SEQUENCE_NUMBERS
+            self._in_flight[sequence_number] = waiter
+
+            return sequence_number
+
+    def release(self, sequence_number: int) -> None:
+        """Marks the request as done. Replies arriving later are not dispatched anymore."""
+        with self._lock:
+            self._in_flight.pop(sequence_number, None)
+
+    def dispatch(self, packet: TLPacket) -> bool:
+        """Hands the packet to the waiter of its sequence number. Returns whether it was accepted."""
+        waiter = self._in_flight.get(packet.sequence_number)  # type: Waiter
+        return waiter is not None and waiter(packet)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""A session with a single switch, keeping its token across many requests."""
+
+from typing import Any, Callable
+
+import TLActions
+from TLActions import TLSwitch, tl_get_token, tl_request
+from TLPacket import TLPacket, TLERRORNAMES
+from TLPacketForge import forge_cable_test, forge_get_port_stats, forge_get_qos, forge_login
+
+
+class TLSession:
+    """Holds the token and login state of one switch. The token is only fetched again
+    after the switch rejected it with ERR_TOKEN_ERROR or stopped answering."""
+
+    def __init__(self, switchmac: bytes, switchip: str, user: str = None, password: str = None,
+                 timeout: float = 1):
+        self.mac = switchmac  # type: bytes
+        self.ip4 = switchip  # type: str
+        self.user = user  # type: str
+        self.password = password  # type: str
+        self.timeout = timeout  # type: float
+
+        self.token = None  # type: int
+        self.logged_in = False  # type: bool
+
+    @classmethod
+    def from_switch(cls, switch: TLSwitch, user: str = None, password: str = None,
+                    timeout: float = 1) -> 'TLSession':
+        """Creates a session for a discovered switch."""
+        return cls(switch.mac, switch.ip4, user, password, timeout)
+
+    def invalidate(self) -> None:
+        """Forgets the token. The next request fetches a new one."""
+        self.token = None
+        self.logged_in = False
+
+    def get_token(self) -> int:
+        """Returns the current token, fetching one if there is none."""
+        if self.token is None:
+            self.token = tl_get_token(self.mac, self.ip4, self.timeout)
+        return self.token
+
+    def login(self, user: str = None, password: str = None) -> int:
+        """Logs in with the given credentials, or the stored ones. Returns the error code, None on timeout."""
+        if user is not None:
+            self.user, self.password = user, password
+
+        result = self._login()  # type: TLPacket
+        return None if result is None else result.error_code
+
+    def _login(self) -> TLPacket:
+        result = self.request(forge_login, self.user, self.password)  # type: TLPacket
+        self.logged_in = result is not None and result.error_code == 0
+        return result
+
+    def with_token(self, exchange: Callable[[int], TLPacket], login: bool = False) -> TLPacket:
+        """Runs exchange(token), which sends a request with the token and returns the answer, None on timeout.
+        If the token was rejected, a new one is fetched and exchange runs once more.
+        With login, the session logs in first if it is not logged in yet. If the switch refuses the login,
+        exchange does not run and the answer to the login is returned instead."""
+        for _ in range(2):
+            if self.get_token() is None:
+                return None
+
+            if login and not self.logged_in and self.user is not None:
+                answer = self._login()  # type: TLPacket
+                if answer is None or answer.error_code != 0:
+                    return answer
+
+            result = exchange(self.token)  # type: TLPacket
+            if result is None:
+                self.invalidate()
+                return None
+
+            if result.error_code != TLERRORNAMES['ERR_TOKEN_ERROR']:
+                return result
+
+            if TLActions.DEBUG:
+                print('Token {0:d} rejected, fetching a new one.'.format(self.token))
+            self.invalidate()
+
+        return result
+
+    def request(self, forge: Callable[..., bytes], *args: Any, login: bool = False, timeout: float = None) -> TLPacket:
+        """Sends the request forge(mac, token, *args) and returns the answer, see with_token."""
+        timeout = self.timeout if timeout is None else timeout  # type: float
+
+        return self.with_token(lambda token: tl_request(self.ip4, timeout, forge, self.mac, token, *args), login)
+
+    def get_port_statistics(self) -> TLPacket:
+        """Get the statistics for all PHYs"""
+        return self.request(forge_get_port_stats)
+
+    def get_qos(self) -> TLPacket:
+        """Retrieves the QoS settings."""
+        return self.request(forge_get_qos)
+
+    def test_cable(self, portnum: int, timeout: float = 10) -> TLPacket:
+        """Tests the cable attached to the switch"""
+        return self.request(forge_cable_test, portnum, self.user, self.password, login=True, timeout=timeout)
@@ -3,7 +3,13 @@
 import argparse
 import ipaddress
 import subcommandPortStatistics
+import subcommandBackup
+import subcommandCableTest
 import subcommandDiscover
+import subcommandExporter
+import subcommandFleetStatistics
+import subcommandRestore
+import subcommandScan
 import TLActions
 
 
@@ -19,18 +25,31 @@ def setup_argparser():
                         help='Timeout for switches to answer requests in seconds. Defaults to 1.',
                         required=False, default=1)
     PARSER.add_argument('-d', '--debug', required=False, action="store_true", help='Show debugging information.')
+    PARSER.add_argument('--cache-age', type=float, required=False, default=3600,
+                        help='Maximum age in seconds of cached discovery results, checked by unicast before use. '
+                             '0 always broadcasts. Defaults to 3600.')
+    PARSER.add_argument('--cache-file', required=False, default=None,
+                        help='File to cache discovery results in. Defaults to ~/.cache/tplink-easy-smart-switch.')
 
     sub = PARSER.add_subparsers(dest='command')
 
     for command in ALL_COMMANDS:
         command.setup_parser(sub.add_parser(command.name()))
 
+    return sub
+
 
 def main():
     ALL_COMMANDS.append(subcommandDiscover)
     ALL_COMMANDS.append(subcommandPortStatistics)
+    ALL_COMMANDS.append(subcommandFleetStatistics)
+    ALL_COMMANDS.append(subcommandExporter)
+    ALL_COMMANDS.append(subcommandBackup)
+    ALL_COMMANDS.append(subcommandRestore)
+    ALL_COMMANDS.append(subcommandCableTest)
+    ALL_COMMANDS.append(subcommandScan)
 
-    setup_argparser()
+    sub = setup_argparser()
 
     result = PARSER.parse_args()
     if result is None:
@@ -38,7 +57,9 @@ def main():
         exit()
 
     if result is not None and result.command is None:
+        # Discovery is the default, it needs the defaults of its own arguments too.
         result.command = "discover"
+        sub.choices[result.command].parse_args([], namespace=result)
 
     TLActions.DEBUG = result.debug
     TLActions.tl_init_sockets()
@@ -3,15 +3,27 @@
 """Main module for cross platform TP-Link Easy Smart Switch Configuration tool"""
 
 
+import asyncio
 import getopt
-from sys import argv
-import socket
+import json
+from sys import argv, stderr, stdout
 
 from TLPresentation import present_discovery
 from TLPacket import TLPacket
 from TLCrypt import tl_rc4_crypt
-from TLActions import tl_discover, TLSwitch, tl_get_token,\
-    PORTSC, PORTCS, tl_init_sockets, tl_test
+from TLCapture import TLCaptureError, TLCaptureFilter, TLCaptureSummary, packet_record, tl_decode_capture
+import TLActions
+from TLActions import tl_discover, REGISTRY, tl_init_sockets
+from TLAsync import TLAsyncClient
+from TLListener import TLListener, FORMATS
+from TLScanner import TLScanError, TLTagScanner
+
+USAGE = '''Usage: decryptp.py [-i IP]           scan the tags of a switch
+       decryptp.py -l [-f FORMAT] [-w FILE]  decode the live traffic, FORMAT is one of text, json, binary
+       decryptp.py -r CAPTURE [-s] [-f FORMAT] [-m MAC] [-o OPCODE] [-t TAG]
+                                       decode a pcap, pcapng or binary log, -s summarizes it
+       decryptp.py -d                  decrypt test.raw
+-m, -o and -t select packets and may be given multiple times. OPCODE and TAG are decimal or hex like 0x4000.'''
 
 
 def choose_switch(switch_ip_arg: str=None):
@@ -22,10 +34,10 @@ def choose_switch(switch_ip_arg: str=None):
     else:
         tl_discover()
 
-    if len(TLSwitch.discovered_switches) > 1:
+    if len(REGISTRY) > 1:
         print(' {0:2s}{1:31s} {2:15s} {3:31s} {4:10s}'
               .format('#', 'Name', 'IP', 'Model', 'Firmware'))
-        for i, switch in enumerate(TLSwitch.discovered_switches):
+        for i, switch in enumerate(REGISTRY):
             print('{0:2d} '.format(i), end='')
             present_discovery(switch.source_packet)
 
@@ -33,15 +45,15 @@ def choose_switch(switch_ip_arg: str=None):
         while selection is None:
             selection_raw = input('Select switch: ')
             if (selection_raw.isnumeric() and
-                    int(selection_raw) in range(0, len(TLSwitch.discovered_switches))):
+                    int(selection_raw) in range(0, len(REGISTRY))):
                 selection = int(selection_raw)
 
-        selected_switch = TLSwitch.discovered_switches[selection]
-    elif len(TLSwitch.discovered_switches) == 1:
+        selected_switch = REGISTRY[selection]
+    elif len(REGISTRY) == 1:
         print('{0:31s} {1:15s} {2:31s} {3:10s}'
               .format('Name', 'IP', 'Model', 'Firmware'))
-        present_discovery(TLSwitch.discovered_switches[0].source_packet)
-        selected_switch = TLSwitch.discovered_switches[0]
+        present_discovery(REGISTRY[0].source_packet)
+        selected_switch = REGISTRY[0]
         print()
     else:
         print('No switches discovered.')
@@ -50,6 +62,18 @@ def choose_switch(switch_ip_arg: str=None):
     return selected_switch
 
 
+async def scan_tags(switch, first: int=25700, last: int=65535):
+    """Print the answer of the switch to a question for every tag from first to last."""
+    # Shares the port already bound by TLActions.
+    async with TLAsyncClient(sock=TLActions.RECEIVER.dup()) as client:
+        try:
+            async for tag, packet in TLTagScanner(client, switch, first, last).scan():
+                print('\u001B[94m-----> Tag {0:d}\n{1}'
+                      '\n<----- Tag {0:d}\n\u001B[0m'.format(tag, str(packet)))
+        except TLScanError as error:
+            print(error)
+
+
 def decrypt_test_dot_raw():
     """Decrypt the packet stored in test.raw, save it to test.dec and display summary"""
     with open('test.raw', 'rb') as encrypted_file:
@@ -67,71 +91,121 @@ def decrypt_test_dot_raw():
     print(packet)
 
 
+def decode_capture(path: str, summary: bool, selection: TLCaptureFilter):
+    """Decode the TP-Link packets of a pcap or pcapng file, as JSON lines or as a summary"""
+    counts = TLCaptureSummary()
+
+    try:
+        for datagram, packet in tl_decode_capture(path, selection):
+            if summary:
+                counts.add(datagram, packet)
+            else:
+                stdout.write(json.dumps(packet_record(datagram, packet)) + '\n')
+    except BrokenPipeError:
+        return
+    except (OSError, TLCaptureError) as error:
+        print(error)
+
+    if summary:
+        print(counts)
+
+
+def listen(output_format: str, output_path: str=None):
+    """Decode all traffic on the ports of the switches until interrupted, with counters per direction at the end"""
+    if output_format not in FORMATS:
+        print('Unknown format {0}, choose one of {1}.'.format(output_format, ', '.join(FORMATS)))
+        return
+
+    binary = output_format == 'binary'
+    if output_path is not None:
+        output = open(output_path, 'ab' if binary else 'a')
+    else:
+        output = stdout.buffer if binary else stdout
+
+    listener = TLListener(output, output_format)
+    try:
+        with listener:
+            listener.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('Computer to switch: {0}\nSwitch to computer: {1}'
+              .format(listener.counters[True], listener.counters[False]), file=stderr)
+        if output_path is not None:
+            output.close()
+
+
+def parse_option(opt: str, arg: str, selection: TLCaptureFilter) -> bool:
+    """Adds a packet filter option to selection. Returns False for other options, raises ValueError for bad values."""
+    if opt == '-m':
+        mac = bytes.fromhex(arg.replace(':', '').replace('-', ''))  # type: bytes
+        if len(mac) != 6:
+            raise ValueError(arg)
+        selection.macs.add(mac)
+    elif opt == '-o':
+        selection.opcodes.add(int(arg, 0))
+    elif opt == '-t':
+        selection.tags.add(int(arg, 0))
+    else:
+        return False
+
+    return True
+
+
 def main():
     """The main method."""
     try:
-        opts = getopt.getopt(argv[1:], 'ldi:')[0]
-    except getopt.GetoptError:
-        opts = []
-    except:
-        raise
+        opts = getopt.getopt(argv[1:], 'ldi:r:sm:o:t:f:w:')[0]
+    except getopt.GetoptError as error:
+        print('{0}\n{1}'.format(error, USAGE), file=stderr)
+        return
 
     only_decrypt = False
     only_listen_and_decrypt = False
     switch_ip_arg = None
+    capture = None
+    output_format = 'text'
+    output_path = None
+    summary = False
+    selection = TLCaptureFilter()
 
     for opt, arg in opts:
+        try:
+            if parse_option(opt, arg, selection):
+                continue
+        except ValueError:
+            print('Invalid value {0} for {1}\n{2}'.format(arg, opt, USAGE), file=stderr)
+            return
+
         if opt == '-i':
             switch_ip_arg = arg
         elif opt == '-d':
             only_decrypt = True
         elif opt == '-l':
             only_listen_and_decrypt = True
+        elif opt == '-r':
+            capture = arg
+        elif opt == '-s':
+            summary = True
+        elif opt == '-f':
+            output_format = arg
+        elif opt == '-w':
+            output_path = arg
+
+    if capture is not None:
+        decode_capture(capture, summary, selection)
+        return
 
     if only_listen_and_decrypt:
-        receive1 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        receive1.bind(('0.0.0.0', PORTSC))
-        receive1.setblocking(False)
-
-        receive2 = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        receive2.bind(('0.0.0.0', PORTCS))
-        receive2.setblocking(False)
-
-        while True:
-            try:
-                data = receive1.recvfrom(1500)[0]
-                packet = TLPacket(tl_rc4_crypt(data))
-
-                print('\u001B[94m-----> Switch to computer\n{0}'
-                      '\n<----- Switch to computer\n\u001B[0m'.format(str(packet)))
-            except IOError:
-                pass
-
-            try:
-                data = receive2.recvfrom(1500)[0]
-                packet = TLPacket(tl_rc4_crypt(data))
-
-                print('\u001B[91m-----> Computer to switch\n{0}'
-                      '\n<----- Computer to switch\n\u001B[0m'.format(str(packet)))
-            except IOError:
-                pass
+        listen(output_format, output_path)
     elif only_decrypt:
         decrypt_test_dot_raw()
     else:
         tl_init_sockets()
         selected_switch = choose_switch(switch_ip_arg)
 
-        for i in range(25700, 65536):
-            if i % 100 == 0:
-                print(i)
-            token = tl_get_token(selected_switch.mac, selected_switch.ip4)
-
-            sent, rec = tl_test(i, selected_switch.mac, selected_switch.ip4, token, .3)
-            if rec is not None:
-                print('\u001B[91m-----> Computer to switch\n{0}'
-                      '\n<----- Computer to switch\n\u001B[0m'.format(str(sent)))
-                print('\u001B[94m-----> Switch to computer\n{0}'
-                      '\n<----- Switch to computer\n\u001B[0m'.format(str(rec)))
+        if selected_switch is not None:
+            asyncio.run(scan_tags(selected_switch))
 
         # stats = tl_get_port_statistics(selected_switch.mac, selected_switch.ip4, 1000)
         # present_port_statistics(stats)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+from getpass import getpass
+import TLActions
+from TLBackup import TLBackupStore
+from TLDiscoveryCache import cache_from_args, tl_discover_cached
+from TLSession import TLSession
+
+
+def name():
+    return 'backup'
+
+
+def setup_parser(parser):
+    parser.add_argument('-o', '--directory', default='backups',
+                        help='Directory to store the configurations in. Defaults to ./backups.')
+    parser.add_argument('-s', '--switch', action='append', default=[], metavar='IP',
+                        help='Back up this switch. May be given multiple times. '
+                             'Defaults to every switch found by discovery.')
+    add_credentials(parser)
+
+
+def add_credentials(parser):
+    parser.add_argument('-u', '--user', default=None, help='User to log in with.')
+    parser.add_argument('-p', '--password', default=None, help='Password. Asked for if a user is given without it.')
+
+
+def credentials(args):
+    if args.user is not None and args.password is None:
+        return args.user, getpass('Password: ')
+    return args.user, args.password
+
+
+def switches(args):
+    targets = list(args.switch)
+    if str(args.ip) != TLActions.BROADCAST_IP:
+        targets.append(str(args.ip))
+
+    if not targets:
+        tl_discover_cached(cache_from_args(args), TLActions.BROADCAST_IP, args.timeout)
+    else:
+        for target in targets:
+            TLActions.tl_discover(target, args.timeout)
+
+    return list(TLActions.REGISTRY)
+
+
+def execute(args):
+    user, password = credentials(args)
+    store = TLBackupStore(args.directory)
+    changed = 0
+
+    for switch in switches(args):
+        session = TLSession.from_switch(switch, user, password, args.timeout)
+        if user is not None and session.login() != 0:
+            print('{0:15s} login failed'.format(switch.ip4))
+            continue
+
+        written, digest = store.backup(session)
+        if digest is None:
+            print('{0:15s} backup failed'.format(switch.ip4))
+        elif written:
+            changed += 1
+            print('{0:15s} changed    {1}'.format(switch.ip4, store.path(switch.mac)))
+        else:
+            print('{0:15s} unchanged'.format(switch.ip4))
+
+    print('{0:d} configuration(s) changed.'.format(changed))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import asyncio
+import TLActions
+from TLAsync import TLAsyncClient, tl_test_all_cables
+from subcommandBackup import add_credentials, credentials
+from subcommandFleetStatistics import discover
+
+
+def name():
+    return 'cableTest'
+
+
+def setup_parser(parser):
+    parser.add_argument('-s', '--switch', action='append', default=[], metavar='IP',
+                        help='Test the cables of this switch. May be given multiple times. '
+                             'Defaults to every switch found by discovery.')
+    parser.add_argument('-P', '--port', action='append', type=int, default=None, metavar='PORT',
+                        help='Test this port. May be given multiple times. Defaults to all ports.')
+    parser.add_argument('-c', '--concurrency', type=int, default=4,
+                        help='Maximum number of ports of one switch tested at once. Defaults to 4.')
+    parser.add_argument('--test-timeout', type=float, default=10,
+                        help='Time in seconds a single cable test may take. Defaults to 10.')
+    add_credentials(parser)
+
+
+async def test(args, user, password):
+    # Shares the port already bound by TLActions.
+    async with TLAsyncClient(sock=TLActions.RECEIVER.dup()) as client:
+        switches = await discover(client, args)
+        failed = 0
+
+        async for switch, portnum, result, error in tl_test_all_cables(client, switches, user, password,
+                                                                       args.concurrency, args.test_timeout, args.port):
+            if result is None:
+                failed += 1
+                if portnum is None:
+                    print('{0:15s} {1}, see --port'.format(switch.ip4, error))
+                else:
+                    print('{0:15s} Port {1:2d}: {2}'.format(switch.ip4, portnum, error))
+            else:
+                print('{0:15s} Port {1:2d}: Length {2:3d}m, Diagnosis: {3:14s}'
+                      .format(switch.ip4, result.port, result.length, result.diagnosis))
+
+        if failed:
+            print('{0:d} test(s) failed.'.format(failed))
+
+
+def execute(args):
+    user, password = credentials(args)
+    if user is None:
+        print('Cable tests need a user, see --user.')
+        return
+
+    asyncio.run(test(args, user, password))
@@ -1,21 +1,62 @@
 #!/usr/bin/env python3
 
+import asyncio
 import TLActions
 import TLPresentation
+from TLArguments import ipv4_interface
+from TLAsync import TLAsyncClient
+from TLDiscoveryCache import cache_from_args, tl_discover_cached
 
 
 def name():
     return 'discover'
 
 
-def setup_parser(_):
-    pass
+def setup_parser(parser):
+    parser.add_argument('-n', '--expect', type=int, default=None,
+                        help='Stop as soon as this many units answered.')
+    parser.add_argument('-m', '--mac', action='append', default=[],
+                        help='Stop as soon as all units with these MAC addresses answered. '
+                             'May be given multiple times.')
+    parser.add_argument('-N', '--network', action='append', default=[], metavar='CIDR', type=ipv4_interface,
+                        help='Also discover this network by directed broadcast, sent from the interface address '
+                             'if one is given, e.g. 192.168.1.10/24. May be given multiple times. '
+                             'A unit given with -i is asked as well.')
 
 
-def execute(args):
-    TLActions.tl_discover(str(args.ip), args.timeout)
+def parse_mac(text):
+    return bytes.fromhex(text.replace(':', '').replace('-', ''))
+
 
-    for i in TLActions.TLSwitch.discovered_switches:
-        TLPresentation.present_discovery(i.source_packet)
+async def discover_networks(args):
+    # Shares the port already bound by TLActions.
+    broadcast = str(args.ip) == TLActions.BROADCAST_IP
+    async with TLAsyncClient(sock=TLActions.RECEIVER.dup()) as client:
+        return await client.discover_networks(args.network, args.timeout, broadcast,
+                                              [] if broadcast else [str(args.ip)])
 
-    print('Discovered ' + str(len(TLActions.TLSwitch.discovered_switches)) + ' unit(s).')
\ No newline at end of file
+
+def execute(args):
+    if args.network:
+        try:
+            switches = asyncio.run(discover_networks(args))
+        except OSError as error:
+            # Most likely an interface address given with -N that is not one of this host.
+            print('Cannot send the discovery: {0}'.format(error))
+            return
+
+        for switch in switches:
+            TLActions.REGISTRY.add(switch)
+            TLPresentation.present_discovery(switch.source_packet)
+    elif args.expect is None and not args.mac:
+        tl_discover_cached(cache_from_args(args), str(args.ip), args.timeout)
+
+        for i in TLActions.REGISTRY:
+            TLPresentation.present_discovery(i.source_packet)
+    else:
+        # Units are shown as they answer.
+        TLActions.tl_discover_all(str(args.ip), args.timeout, args.expect,
+                                  {parse_mac(mac) for mac in args.mac} if args.mac else None,
+                                  lambda switch: TLPresentation.present_discovery(switch.source_packet))
+
+    print('Discovered ' + str(len(TLActions.REGISTRY)) + ' unit(s).')
\ No newline at end of file
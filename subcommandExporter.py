@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+import TLActions
+from TLArguments import positive_float
+from TLAsync import TLAsyncClient, tl_poll_port_statistics
+from TLInfos import PortStatisticsColumns, PORT_MODES
+from TLPacket import TLPacket
+from TLTLVs import TLVTAGS
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'  # type: str
+
+
+def name():
+    return 'exporter'
+
+
+def setup_parser(parser):
+    parser.add_argument('-l', '--listen', default='0.0.0.0:9717', metavar='HOST:PORT',
+                        help='Address to serve the metrics on. Defaults to 0.0.0.0:9717.')
+    parser.add_argument('-s', '--switch', action='append', default=[], metavar='IP',
+                        help='Export this switch. May be given multiple times. '
+                             'Defaults to every switch found by discovery.')
+    parser.add_argument('--interval', type=positive_float, default=15,
+                        help='Seconds between two polls of all switches. Defaults to 15.')
+    parser.add_argument('--rediscover', type=positive_float, default=300,
+                        help='Seconds between two discoveries. Defaults to 300.')
+    parser.add_argument('--ttl', type=positive_float, default=None,
+                        help='Seconds after which a switch that answered neither discovery nor polls '
+                             'is no longer exported. Defaults to three times --rediscover.')
+    parser.add_argument('-c', '--concurrency', type=int, default=64,
+                        help='Maximum number of switches polled at once. Defaults to 64.')
+    parser.add_argument('--deadline', type=positive_float, default=3,
+                        help='Time in seconds a single switch may take to answer all requests. Defaults to 3.')
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return '{' + ','.join('{0}="{1}"'.format(key, escape(value)) for key, value in values.items()) + '}'
+
+
+def tlv_text(packet: TLPacket, tag: str) -> str:
+    tlv = packet.get(TLVTAGS[tag])
+    return '' if tlv is None else tlv.get_human_readable_value()
+
+
+class Snapshot:
+    """The state of all switches as last seen by the poller, rendered once per poll.
+    Scrapes only ever read the rendered text."""
+
+    def __init__(self):
+        self.switches = {}  # type: Dict[bytes, TLActions.TLSwitch]
+        self.stats = {}  # type: Dict[bytes, Tuple[float, PortStatisticsColumns]]
+        self.up = {}  # type: Dict[bytes, bool]
+        self.poll_duration = 0.0  # type: float
+        self.text = b'# EOF\n'  # type: bytes
+        # Set when the poller stopped for good, the text is then no longer served.
+        self.stale = False  # type: bool
+
+    def render(self) -> None:
+        families = {
+            'tplink_switch': ('info', 'Discovery information of the switch.', []),
+            'tplink_switch_up': ('gauge', 'Whether the switch answered the last poll.', []),
+            'tplink_switch_last_poll_timestamp_seconds': ('gauge', 'Time of the last answer of the switch.', []),
+            'tplink_port_enabled': ('gauge', 'Whether the port is enabled.', []),
+            'tplink_port_link_mode': ('gauge', 'Current link mode: ' + ', '.join(
+                '{0:d} {1}'.format(mode, text) for mode, text in PORT_MODES.items()) + '.', []),
+            'tplink_port_link_up': ('gauge', 'Whether the port has a link.', []),
+            'tplink_port_tx_good_packets': ('counter', 'Packets sent successfully.', []),
+            'tplink_port_tx_bad_packets': ('counter', 'Packets failed to send.', []),
+            'tplink_port_rx_good_packets': ('counter', 'Packets received successfully.', []),
+            'tplink_port_rx_bad_packets': ('counter', 'Packets received with errors.', []),
+            'tplink_exporter_poll_duration_seconds': ('gauge', 'Time the last poll of all switches took.', []),
+        }  # type: Dict[str, Tuple[str, str, List[str]]]
+
+        for mac, switch in self.switches.items():
+            mac_text = mac.hex(':')
+            packet = switch.source_packet
+            families['tplink_switch'][2].append('tplink_switch_info{0} 1'.format(labels(
+                mac=mac_text, ip=switch.ip4, name=switch.name,
+                model=tlv_text(packet, 'SYSINFO_HARD_VERSION'), firmware=tlv_text(packet, 'SYSINFO_FIRM_VERSION'))))
+            families['tplink_switch_up'][2].append('tplink_switch_up{0} {1:d}'.format(
+                labels(mac=mac_text), self.up.get(mac, False)))
+
+            if mac not in self.stats:
+                continue
+
+            timestamp, stats = self.stats[mac]
+            families['tplink_switch_last_poll_timestamp_seconds'][2].append(
+                'tplink_switch_last_poll_timestamp_seconds{0} {1:.3f}'.format(labels(mac=mac_text), timestamp))
+
+            # Rendered column by column, straight from the arrays.
+            port_labels = [labels(mac=mac_text, port=number) for number in stats.columns['number']]
+            for family, values in (('tplink_port_enabled', stats.columns['enabled']),
+                                   ('tplink_port_link_mode', stats.columns['current_mode']),
+                                   ('tplink_port_link_up', stats.link_up())):
+                families[family][2].extend('{0}{1} {2:d}'.format(family, port_label, value)
+                                           for port_label, value in zip(port_labels, values))
+
+            for counter in ('tx_good', 'tx_bad', 'rx_good', 'rx_bad'):
+                family = 'tplink_port_{0}_packets'.format(counter)
+                families[family][2].extend('{0}_total{1} {2:d}'.format(family, port_label, value)
+                                           for port_label, value in zip(port_labels, stats.columns[counter]))
+
+        families['tplink_exporter_poll_duration_seconds'][2].append(
+            'tplink_exporter_poll_duration_seconds {0:.3f}'.format(self.poll_duration))
+
+        lines = []  # type: List[str]
+        for family, (kind, description, samples) in families.items():
+            lines.append('# TYPE {0} {1}'.format(family, kind))
+            lines.append('# HELP {0} {1}'.format(family, description))
+            lines.extend(samples)
+        lines.append('# EOF\n')
+
+        self.text = '\n'.join(lines).encode('utf-8')
+
+
+class Poller:
+    """Refreshes the snapshot in the background, in its own event loop."""
+
+    def __init__(self, args, snapshot: Snapshot):
+        self.args = args
+        self.snapshot = snapshot  # type: Snapshot
+
+    async def discover(self, client: TLAsyncClient) -> None:
+        targets = list(self.args.switch)
+        if str(self.args.ip) != TLActions.BROADCAST_IP:
+            targets.append(str(self.args.ip))
+
+        if not targets:
+            targets = [TLActions.BROADCAST_IP]
+
+        # The switches found are added to the registry of the client.
+        await asyncio.gather(*[client.discover(target, self.args.timeout) for target in targets])
+
+    async def poll(self, client: TLAsyncClient) -> None:
+        began = time.monotonic()
+
+        # Switches the registry forgot are no longer exported.
+        self.snapshot.switches = {switch.mac: switch for switch in client.registry}
+        for state in (self.snapshot.stats, self.snapshot.up):
+            for mac in [mac for mac in state if mac not in self.snapshot.switches]:
+                del state[mac]
+
+        async for switch, stats in tl_poll_port_statistics(
+                client, list(self.snapshot.switches.values()), self.args.concurrency,
+                self.args.deadline, self.args.timeout):
+            self.snapshot.up[switch.mac] = stats is not None
+            if stats is not None:
+                client.registry.add(switch)
+                self.snapshot.stats[switch.mac] = (time.time(), PortStatisticsColumns(stats))
+
+        self.snapshot.poll_duration = time.monotonic() - began
+        self.snapshot.render()
+
+    def run_forever(self) -> None:
+        """Runs the poller until it fails for good, then marks the snapshot stale."""
+        try:
+            asyncio.run(self.run())
+        finally:
+            self.snapshot.stale = True
+            print('Poller stopped, metrics are no longer served.', file=sys.stderr)
+
+    async def run(self) -> None:
+        # Shares the port already bound by TLActions.
+        ttl = 3 * self.args.rediscover if self.args.ttl is None else self.args.ttl
+        async with TLAsyncClient(sock=TLActions.RECEIVER.dup(), ttl=ttl) as client:
+            last_discovery = None
+            start = time.monotonic()
+
+            while True:
+                try:
+                    if last_discovery is None or time.monotonic() - last_discovery >= self.args.rediscover:
+                        await self.discover(client)
+                        last_discovery = time.monotonic()
+
+                    await self.poll(client)
+                except Exception as error:
+                    # A failed poll must not end polling, the next one may well succeed.
+                    print('Poll failed: {0!r}'.format(error), file=sys.stderr)
+                    if TLActions.DEBUG:
+                        traceback.print_exc()
+                    self.snapshot.up.clear()
+                    self.snapshot.render()
+
+                # Next slot of a fixed schedule, skipping slots a slow poll missed.
+                slots = int((time.monotonic() - start) / self.args.interval) + 1
+                await asyncio.sleep(start + slots * self.args.interval - time.monotonic())
+
+
+def make_handler(snapshot: Snapshot):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            if snapshot.stale:
+                self.send_error(503, 'Poller stopped')
+                return
+
+            text = snapshot.text
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(text)))
+            self.end_headers()
+            self.wfile.write(text)
+
+        def log_message(self, *_):
+            if TLActions.DEBUG:
+                BaseHTTPRequestHandler.log_message(self, *_)
+
+    return MetricsHandler
+
+
+def execute(args):
+    host, port = args.listen.rsplit(':', 1)
+    snapshot = Snapshot()
+
+    poller = threading.Thread(target=Poller(args, snapshot).run_forever, daemon=True)
+    poller.start()
+
+    server = ThreadingHTTPServer((host, int(port)), make_handler(snapshot))
+    print('Serving metrics on http://{0}:{1}/metrics'.format(host, port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
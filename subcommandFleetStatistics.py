@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import asyncio
+import TLActions
+import TLPresentation
+from TLAsync import TLAsyncClient, tl_poll_port_statistics
+
+
+def name():
+    return 'pollStats'
+
+
+def setup_parser(parser):
+    parser.add_argument('-s', '--switch', action='append', default=[], metavar='IP',
+                        help='Poll this switch. May be given multiple times. '
+                             'Defaults to every switch found by discovery.')
+    parser.add_argument('-c', '--concurrency', type=int, default=64,
+                        help='Maximum number of switches polled at once. Defaults to 64.')
+    parser.add_argument('--deadline', type=float, default=3,
+                        help='Time in seconds a single switch may take to answer all requests. Defaults to 3.')
+
+
+async def discover(client, args):
+    targets = list(args.switch)
+
+    if str(args.ip) != TLActions.BROADCAST_IP:
+        targets.append(str(args.ip))
+
+    if not targets:
+        return await client.discover(TLActions.BROADCAST_IP, args.timeout)
+
+    switches = {}
+    for found in await asyncio.gather(*[client.discover(target, args.timeout) for target in targets]):
+        for switch in found:
+            switches.setdefault(switch.mac, switch)
+
+    return list(switches.values())
+
+
+async def poll(args):
+    # Shares the port already bound by TLActions.
+    async with TLAsyncClient(sock=TLActions.RECEIVER.dup()) as client:
+        switches = await discover(client, args)
+        answered = 0
+
+        async for switch, stats in tl_poll_port_statistics(client, switches, args.concurrency,
+                                                           args.deadline, args.timeout):
+            if stats is None:
+                print('No answer from ' + switch.ip4)
+                continue
+
+            answered += 1
+            print('Port Statistics of ' + switch.ip4)
+            TLPresentation.present_port_statistics(stats)
+            print()
+
+        print('Polled {0:d} of {1:d} unit(s).'.format(answered, len(switches)))
+
+
+def execute(args):
+    asyncio.run(poll(args))
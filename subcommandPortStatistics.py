@@ -1,20 +1,27 @@
 #!/usr/bin/env python3
 
+import sys
+import time
+from typing import List, Tuple
 import TLActions
 import TLPresentation
+from TLArguments import positive_float
+from TLInfos import PortStatistics, PortStatisticsPort, format_port
+from TLDiscoveryCache import cache_from_args, tl_discover_cached
+from TLSession import TLSession
 
 SWITCH = ...  # type: TLActions.TLSwitch
-TOKEN = ...  # type: int
+SESSION = ...  # type: TLSession
 
 
-def discover_and_token(args):
-    global SWITCH, TOKEN
-    SWITCH = TLActions.tl_discover(str(args.ip), args.timeout)
+def discover_and_session(args):
+    global SWITCH, SESSION
+    SWITCH = tl_discover_cached(cache_from_args(args), str(args.ip), args.timeout)
     if SWITCH is None:
         print('Found more than one unit.')
         return False
     else:
-        TOKEN = TLActions.tl_get_token(SWITCH.mac, SWITCH.ip4, args.timeout)
+        SESSION = TLSession.from_switch(SWITCH, timeout=args.timeout)
         return True
 
 
@@ -22,17 +29,99 @@ def name():
     return 'showStats'
 
 
-def setup_parser(_):
-    pass
+def setup_parser(parser):
+    parser.add_argument('--interval', type=positive_float, default=None,
+                        help='Poll again every INTERVAL seconds and only redraw ports that changed.')
+    parser.add_argument('--count', type=int, default=None,
+                        help='Number of polls. Defaults to 1, or endless if an interval is given. '
+                             'Without an interval, the polls follow each other directly.')
+
+
+class IncrementalTable:
+    """Draws the port table once and afterwards only rewrites the rows that changed.
+    If the output is no terminal, changed rows are appended instead."""
+
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self.rows = []  # type: List[Tuple]
+        self.in_place = stream.isatty()  # type: bool
+
+    @staticmethod
+    def key(port: PortStatisticsPort):
+        return (port.number, port.enabled, port.current_mode,
+                port.tx_good, port.tx_bad, port.rx_good, port.rx_bad)
+
+    def update(self, stats: PortStatistics) -> None:
+        rows = [self.key(port) for port in stats.ports]
+
+        if len(rows) != len(self.rows):
+            # First poll or the port list changed, draw everything.
+            print('{0:>2s} {1:>8s} {2:>10s} {3:>10s} {4:>10s} {5:>10s} {6:>10s}'
+                  .format('#', 'State', 'Mode', 'Tx Good', 'Tx Bad', 'Rx Good', 'Rx Bad'), file=self.stream)
+            for port in stats.ports:
+                print(format_port(port), file=self.stream)
+        else:
+            output = []
+            for index, port in enumerate(stats.ports):
+                if rows[index] == self.rows[index]:
+                    continue
+
+                if self.in_place:
+                    up = len(rows) - index
+                    output.append('\u001B[{0:d}A\r{1}\u001B[K\u001B[{0:d}B\r'.format(up, format_port(port)))
+                else:
+                    output.append(time.strftime('%H:%M:%S ') + format_port(port) + '\n')
+
+            self.stream.write(''.join(output))
+
+        self.stream.flush()
+        self.rows = rows
+
+
+def watch(args):
+    count = args.count if args.count is not None else (None if args.interval else 1)
+    table = IncrementalTable()
+    start = time.monotonic()
+    polls = 0
+
+    while count is None or polls < count:
+        stats = SESSION.get_port_statistics()
+        polls += 1
+
+        if stats is None:
+            print('No answer from ' + SWITCH.ip4)
+            # The message moved the table up, draw it again next time.
+            table.rows = []
+        else:
+            table.update(PortStatistics(stats))
+
+        if args.interval is None or polls == count:
+            # Without an interval the polls follow each other directly, and none follows the last.
+            continue
+
+        # Sleep until the next slot of the fixed schedule. Slots missed by slow answers are skipped.
+        now = time.monotonic()
+        slots = int((now - start) / args.interval) + 1
+        time.sleep(start + slots * args.interval - now)
 
 
 def execute(args):
-    global SWITCH, TOKEN
+    global SWITCH, SESSION
 
-    if not discover_and_token(args):
+    if not discover_and_session(args):
         return
 
-    stats = TLActions.tl_get_port_statistics(SWITCH.mac, SWITCH.ip4, TOKEN, args.timeout)
     print('Port Statistics of ' + SWITCH.ip4)
-    TLPresentation.present_port_statistics(stats)
 
+    if args.interval is None and args.count is None:
+        stats = SESSION.get_port_statistics()
+        if stats is None:
+            print('No answer from ' + SWITCH.ip4)
+        else:
+            TLPresentation.present_port_statistics(stats)
+        return
+
+    try:
+        watch(args)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import TLActions
+from subcommandBackup import add_credentials, credentials
+from TLBackup import tl_restore
+from TLPacket import TLERRORCODES
+from TLSession import TLSession
+
+
+def name():
+    return 'restore'
+
+
+def setup_parser(parser):
+    parser.add_argument('-f', '--file', required=True, help='Configuration file to upload.')
+    add_credentials(parser)
+
+
+def execute(args):
+    if str(args.ip) == TLActions.BROADCAST_IP:
+        print('Restoring needs the IP address of a single unit (-i).')
+        return
+
+    user, password = credentials(args)
+    if user is None:
+        print('Restoring needs a user (-u).')
+        return
+
+    switch = TLActions.tl_discover(str(args.ip), args.timeout)
+    if switch is None:
+        print('No answer from ' + str(args.ip))
+        return
+
+    session = TLSession.from_switch(switch, user, password, args.timeout)
+    with open(args.file, 'rb') as config_file:
+        result = tl_restore(session, config_file)
+
+    if result is None:
+        print('No answer from ' + switch.ip4)
+    else:
+        print('Restore finished: {0} ({1:d})'.format(TLERRORCODES.get(result, '?'), result))
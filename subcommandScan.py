@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import sys
+import time
+import TLActions
+from TLArguments import tlv_tag
+from TLAsync import TLAsyncClient
+from TLScanner import TLScanCheckpoint, TLScanError, TLTagScanner, tag_record
+
+
+PARSER = None
+
+
+def name():
+    return 'scanTags'
+
+
+def setup_parser(parser):
+    global PARSER
+    PARSER = parser
+
+    parser.add_argument('-o', '--output', default=None,
+                        help='File to append the answered tags to, as JSON lines. Defaults to stdout.')
+    parser.add_argument('--checkpoint', default=None,
+                        help='File to keep the progress in. Defaults to the output file with .checkpoint appended. '
+                             'A scan of the same switch and range resumes from it.')
+    parser.add_argument('--first', type=tlv_tag, default=1, help='First tag to probe. Defaults to 1.')
+    parser.add_argument('--last', type=tlv_tag, default=65534, help='Last tag to probe. Defaults to 65534.')
+    parser.add_argument('-w', '--window', type=int, default=16,
+                        help='Probes in flight at the start. Adapts to the loss rate later. Defaults to 16.')
+    parser.add_argument('--max-window', type=int, default=256,
+                        help='Maximum number of probes in flight. Defaults to 256.')
+    parser.add_argument('--probe-timeout', type=float, default=0.3,
+                        help='Time in seconds to wait for the answer to a probe. Defaults to 0.3.')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='Number of times a lost probe is sent again. Defaults to 2.')
+
+
+def sync(output):
+    output.flush()
+    try:
+        os.fsync(output.fileno())
+    except OSError:
+        # Pipes and terminals cannot be synced.
+        pass
+
+
+async def scan(args, output):
+    # Shares the port already bound by TLActions.
+    async with TLAsyncClient(sock=TLActions.RECEIVER.dup()) as client:
+        switches = await client.discover(str(args.ip), args.timeout)
+        if len(switches) != 1:
+            print('Found {0:d} units, select one with -i.'.format(len(switches)))
+            return
+
+        checkpoint_path = args.checkpoint
+        if checkpoint_path is None and args.output is not None:
+            checkpoint_path = args.output + '.checkpoint'
+
+        scanner = TLTagScanner(client, switches[0], args.first, args.last, args.window, args.max_window,
+                               args.probe_timeout, args.retries,
+                               None if checkpoint_path is None else TLScanCheckpoint(checkpoint_path),
+                               before_save=lambda: sync(output))
+        start = time.monotonic()
+        reported = start
+
+        try:
+            async for tag, packet in scanner.scan():
+                output.write(json.dumps(tag_record(tag, packet)) + '\n')
+
+                if time.monotonic() - reported >= 5:
+                    output.flush()
+                    reported = time.monotonic()
+                    print('{0:d} tags left, {1:d} in flight, {2:.1%} loss'
+                          .format(scanner.remaining, int(scanner.window), scanner.loss), file=sys.stderr)
+        except TLScanError as error:
+            print(error, file=sys.stderr)
+        finally:
+            output.flush()
+
+        print('{0:d} tags answered, {1:d} unanswered, {2:d} probes lost, {3:.1f}s'
+              .format(scanner.answered, scanner.unanswered, scanner.lost, time.monotonic() - start),
+              file=sys.stderr)
+
+
+def execute(args):
+    if args.first > args.last:
+        PARSER.error('--first {0:d} is above --last {1:d}'.format(args.first, args.last))
+
+    if args.output is None:
+        asyncio.run(scan(args, sys.stdout))
+        return
+
+    with open(args.output, 'a') as output:
+        try:
+            asyncio.run(scan(args, output))
+        except KeyboardInterrupt:
+            print('Interrupted, run again to resume.', file=sys.stderr)